@@ -1,11 +1,103 @@
-import json
+import os
 import csv
+import json
+import itertools
 import pandas as pd
-import random
-from urllib.request import urlopen
+import numpy as np
 from tqdm import tqdm
 import DataGeneratorPredictors
-from DataGeneratorPredictors import Predictors
+import DataGeneratorOutput
+from DataGeneratorPredictors import Predictors, parseTimestamps
+from DataGeneratorSEPA import SEPAClient
+from DataGeneratorStatistics import QuantileSketch
+from DataGeneratorMetrics import Metrics
+from DataGeneratorEvents import EventIndex
+
+# Layout of the .npy sidecar file saved next to a rainfall CSV. Rows without a valid value have a NaN value.
+RAINFALL_SIDECAR_DTYPE = np.dtype([('Timestamp', 'datetime64[ms]'), ('Value', 'float64')])
+
+# The categories used by simplifyData, in the order of their integer codes.
+SIMPLIFIED_CATEGORIES = {'Precipitation': ['Dry', 'Light Rainfall', 'Heavy Rainfall'],
+                         'Flow Rate': ['Slow', 'Steady', 'Fast'],
+                         'Water Level': ['Low', 'Medium', 'High']}
+
+# Default directory to write the generated data to.
+GENERATED_DATA_DIRECTORY = '/home/iain/Desktop/IEL/Data/Generated Data'
+
+# The sources pollutants can come from, in the order of the rows of the source inflow array.
+POLLUTANT_SOURCES = ['Damn', 'Rainfall']
+
+# Name of the file in the output directory which the simulator state is saved to after each day, so a run can be resumed or extended.
+CHECKPOINT_NAME = 'Checkpoint.json'
+
+def clampedCumulativeLevel(startingLevel, levelDerivative, minimum : float = 0.1, maximum : float = 2.6):
+    # Calculate level[i] = clamp(level[i-1] + levelDerivative[i]) along the last axis, with level[0] = startingLevel.
+    # startingLevel can be a scalar, or an array with one value per row of levelDerivative.
+    levelDerivative = np.array(levelDerivative, dtype=float)
+    startingLevel = np.asarray(startingLevel, dtype=float)[..., np.newaxis]
+    levelDerivative[..., 0] = 0
+
+    # Fast path: a plain cumulative sum is exact as long as the level never needs clamping.
+    level = startingLevel + np.cumsum(levelDerivative, axis=-1)
+    samples = level.shape[-1]
+    outOfRange = (level[..., 1:] < minimum) | (level[..., 1:] > maximum)
+    if not outOfRange.any():
+        return level
+
+    # Otherwise clamp each step in turn, but only for the rows which actually hit a bound (still vectorised across those rows).
+    rows = np.flatnonzero(outOfRange.reshape(-1, samples - 1).any(axis=1))
+    flatLevel = level.reshape(-1, samples)
+    flatDerivative = levelDerivative.reshape(-1, samples)[rows]
+    clamped = flatLevel[rows]
+    for i in range(1, samples):
+        clamped[:, i] = np.clip(clamped[:, i-1] + flatDerivative[:, i], minimum, maximum)
+    flatLevel[rows] = clamped
+
+    return level
+
+def linearRecurrence(start, factors, additions, blockSize : int = 32):
+    # Calculate x[i] = factors[i] * x[i-1] + additions[i] along the last axis, with x[-1] = start, without a Python loop per sample.
+    # factors must be in (0, 1]. Within a block x[i] = P[i] * (x[-1] + sum(additions[j] / P[j] for j <= i)), where P is the
+    # cumulative product of the block's factors. Restarting P every blockSize samples stops it underflowing (and 1 / P overflowing).
+    factors, additions = np.broadcast_arrays(np.asarray(factors, dtype=float), np.asarray(additions, dtype=float))
+    x = np.zeros(factors.shape)
+    previous = np.asarray(start, dtype=float)
+    for first in range(0, factors.shape[-1], blockSize):
+        block = slice(first, first + blockSize)
+        product = np.cumprod(factors[..., block], axis=-1)
+        x[..., block] = product * (previous[..., np.newaxis] + np.cumsum(additions[..., block] / product, axis=-1))
+        previous = x[..., first + product.shape[-1] - 1]
+    return x
+
+def pollutantWeights(pollutants : list() = None):
+    # Sum the (Source, Pollutant, Concentration) tuples into a (pollutants x sources) matrix of concentrations,
+    # so the concentration of every pollutant can be calculated with one matrix product.
+    # Returns the pollutant names (in the order they first appear) and the matrix.
+    names = []
+    for source, pollutant, concentration in pollutants or []:
+        if source not in POLLUTANT_SOURCES:
+            raise ValueError("Unknown pollutant source " + repr(source) + ", expected one of " + ", ".join(POLLUTANT_SOURCES))
+        if pollutant not in names:
+            names.append(pollutant)
+
+    weights = np.zeros((len(names), len(POLLUTANT_SOURCES)))
+    for source, pollutant, concentration in pollutants or []:
+        weights[names.index(pollutant), POLLUTANT_SOURCES.index(source)] += concentration
+    return names, weights
+
+def simplifyChunk(df, mean : float, flowQuartiles : tuple(), levelQuartiles : tuple()):
+    # Label the rows of a dataframe for simplifyData. Each column is returned as a pandas Categorical.
+    def categorical(codes, categories):
+        return pd.Categorical.from_codes(codes.astype(np.int8), categories=categories)
+
+    rainfall = df['Precipitation'].to_numpy(dtype=float)
+    flow = df['Flow Rate'].to_numpy(dtype=float)
+    level = df['Water Level'].to_numpy(dtype=float)
+
+    return pd.DataFrame({
+        'Precipitation': categorical(np.select([rainfall == 0, rainfall < mean], [0, 1], 2), SIMPLIFIED_CATEGORIES['Precipitation']),
+        'Flow Rate': categorical(np.select([flow < flowQuartiles[0], flow < flowQuartiles[1]], [0, 1], 2), SIMPLIFIED_CATEGORIES['Flow Rate']),
+        'Water Level': categorical(np.select([level < levelQuartiles[0], level < levelQuartiles[1]], [0, 1], 2), SIMPLIFIED_CATEGORIES['Water Level'])})
 
 class DataGenerator():
     def __init__(self,
@@ -15,17 +107,31 @@ class DataGenerator():
                 volumeOfWaterComingFromDamn: list() = None, # The volume of water coming from the damn (m3)
                 catchementArea: float = 58.5,               # The catchment area of rainfall which feeds into the river (km2)
                 pollutants: list() = None,                  # A list of tuples of (Source, Pollutant, Concentration) pairs
+                mixingVolume: float = 10000,                # Volume of the river the pollutants mix into, e.g. 1km of river 20m wide and 0.5m deep (m3)
                 property_flooding_level: float = 1.0,       # The level at which property flooding occurs (m)
                 low_lying_land_flooding_level: float = 1.0, # The level at which low lying land flooding occurs (e.g. farm, marshland) (m)
-                predictors : Predictors = None):
+                predictors : Predictors = None,
+                outputDirectory : str = GENERATED_DATA_DIRECTORY, # The directory to write the generated data to
+                outputFormats : list() = ('csv',),          # The formats to write the generated data in ("csv", "npy" and/or "parquet")
+                metrics : Metrics = None):                  # Records stage times, passes per day and samples per second. Defaults to the predictors' metrics
 
         self.numOfSamples = numOfSamples
         self.rainfall = rainfall
         self.startingWaterLevel = startingWaterLevel
         self.catchementArea = catchementArea
         self.pollutants = pollutants
+        self.pollutantNames, self.pollutantWeights = pollutantWeights(pollutants)
+        self.mixingVolume = mixingVolume
+
+        # Amount of each pollutant in the river (concentration x m3), carried from one day (or call) to the next.
+        self.pollutantMass = np.zeros(len(self.pollutantNames))
         self.property_flooding_level = property_flooding_level
         self.low_lying_land_flooding_level = low_lying_land_flooding_level
+        self.outputDirectory = outputDirectory
+        self.outputFormats = outputFormats
+
+        # Timestamps of the rainfall samples, if they were read from SEPA or a CSV file.
+        self.rainfallTimestamps = None
 
         # If the volume of water coming from the damn is not specified, set it to 0
         if volumeOfWaterComingFromDamn is None:
@@ -35,75 +141,350 @@ class DataGenerator():
 
         # If a predictor hasn't been calculated in advance, calculate it now. Not recommended as training the predictor takes a few seconds.
         if predictors is None:
-            self.predictors = Predictors()
+            self.predictors = Predictors(metrics=metrics)
         else:
             self.predictors = predictors
 
+        self.metrics = self.predictors.metrics if metrics is None else metrics
+
     def calculate_quarter_hourly_flow_rate(self, quarterHourlyLevels = None):
         # Calculate the flow rate for each quarter-hourly sample.
         # If the levels are provided then use them for more accurate calculations.
         # Otherwise just assume the water level is constant throughout the day.
-        curWaterLevel = self.startingWaterLevel
-
+        # The starting water level can also be an array with one value per ensemble member, giving a (members x samples) result.
         if (quarterHourlyLevels is None):
-            return [self.predictors.generateQuarterHourlyFlow(curWaterLevel)] * self.numOfSamples
+            startingLevel = np.asarray(self.startingWaterLevel, dtype=float)[..., np.newaxis]
+            return self.predictors.generateQuarterHourlyFlowBatch(startingLevel).repeat(self.numOfSamples, axis=-1)
 
-        flowRate = [0.0]*self.numOfSamples
-
-        for i in range(self.numOfSamples):
-            curWaterLevel = quarterHourlyLevels[i]
-            flowRate[i] = self.predictors.generateQuarterHourlyFlow(curWaterLevel)
-    
-        return flowRate
+        # Predict the flow rate for every sample in one vectorised call.
+        return self.predictors.generateQuarterHourlyFlowBatch(np.asarray(quarterHourlyLevels)[..., :self.numOfSamples])
 
     def calculate_quarter_hourly_water_diff(self, flowRate):
         # Calculate the difference in water volume for each quarter-hourly sample.
         # Rainfall measured in mm
         # flowRate and volumeOfWaterComingFromDamn measured in m3/s
 
-        rainMultiplier = DataGeneratorPredictors.getRainfallMultiplier()
+        rainMultiplier = DataGeneratorPredictors.getRainfallMultiplier(self.catchementArea)
 
-        # 900 = Number of seconds in 15 minutes.
-        return [(y*rainMultiplier + (x - z)*900) for x, y, z in zip(self.volumeOfWaterComingFromDamn, self.rainfall, flowRate)]
+        flowRate = np.asarray(flowRate, dtype=float)
+        samples = flowRate.shape[-1]
+        rainfall = np.asarray(self.rainfall[:samples], dtype=float)
+        damn = np.asarray(self.volumeOfWaterComingFromDamn[:samples], dtype=float)
 
-    def calculateDailyLevelDerivative(self, dailyWaterDifference, startingHeight):
+        # 900 = Number of seconds in 15 minutes.
+        return rainfall*rainMultiplier + (damn - flowRate)*900
+
+    def calculate_quarter_hourly_concentrations(self, flowRate):
+        # Calculate the concentration of each pollutant in the river for each quarter-hourly sample with a mass balance.
+        # The river is treated as one fully mixed body of water of mixingVolume m3. Each sample the inflows bring their pollutants in
+        # (inflow x concentration x 900s) and the flow leaving carries flowRate x 900 m3 out at the river's concentration, so pollutants
+        # build up while the flow is low and are washed out when it is high. The step is implicit, so it is stable for any flow rate.
+        # The pollutants left in the river at the end are kept in self.pollutantMass and carried into the next call.
+        # Limits of the model: the mixing volume doesn't change with the water level, the pollutants don't decay or settle out,
+        # the water coming from upstream is clean and the inflows mix in straight away.
+        # Concentrations are in the units they were given in.
+        # Returns a dictionary of "Concentration <pollutant>" to an array the same shape as flowRate.
+        if len(self.pollutantNames) == 0:
+            return {}
+        rainMultiplier = DataGeneratorPredictors.getRainfallMultiplier(self.catchementArea)
+
+        flowRate = np.asarray(flowRate, dtype=float)
+        samples = flowRate.shape[-1]
+        rainfall = np.asarray(self.rainfall[:samples], dtype=float)
+        damn = np.asarray(self.volumeOfWaterComingFromDamn[:samples], dtype=float)
+
+        # (sources x samples) inflows, in the order of POLLUTANT_SOURCES. 900 = Number of seconds in 15 minutes.
+        inflows = np.stack([damn, rainfall*rainMultiplier/900])
+        loads = self.pollutantWeights @ inflows
+
+        # Broadcast the (pollutants x samples) loads against every row of flowRate (e.g. ensemble members).
+        loads = loads.reshape((len(self.pollutantNames),) + (1,)*(flowRate.ndim - 1) + (samples,))
+        mass = np.asarray(self.pollutantMass, dtype=float).reshape((len(self.pollutantNames),) + (1,)*(flowRate.ndim - 1))
+
+        # mass[i] = (mass[i-1] + load[i] x 900) / (1 + flowRate[i] x 900 / mixingVolume)
+        factors = 1 / (1 + np.maximum(flowRate, 0)*900/self.mixingVolume)
+        mass = linearRecurrence(mass, factors, loads*900*factors)
+        self.pollutantMass = mass[..., -1]
+        concentrations = mass / self.mixingVolume
+
+        return {'Concentration ' + name: concentrations[i] for i, name in enumerate(self.pollutantNames)}
+
+    def outputColumns(self):
+        # The columns written for each sample: rainfall, flow rate, water level and the concentration of each pollutant.
+        return DataGeneratorOutput.OUTPUT_COLUMNS + ['Concentration ' + name for name in self.pollutantNames]
+
+    def calculateDailyLevelDerivative(self, dailyWaterDifference, startingHeight, noise = None):
         # Use the ML models in the Predictor class to estimate a value for the daily change in water level.
-        predicted = self.predictors.generateLevelDerivativeFromWaterDifference(dailyWaterDifference)
+        # If noise is given it is added to the expected change instead of drawing new gaussian noise.
+        if noise is None:
+            predicted = self.predictors.generateLevelDerivativeFromWaterDifference(dailyWaterDifference)
+        else:
+            predicted = self.predictors.expectedLevelDerivative(dailyWaterDifference) + noise
 
         # Try to prevent the water level from going below 0.2m
-        if startingHeight + predicted < 0.2:
-            return 0.2 - startingHeight
-
-        return predicted
-
-    def calculateQuarterHourlyLevelDifference(self, dailyLevelDifference, quarterHourlyWaterDifference):
-        quarter_hourly_water_difference = [0.0] * len(quarterHourlyWaterDifference)
-        totalWaterDifference = sum(quarterHourlyWaterDifference)
-        for i in range(len(quarterHourlyWaterDifference)):
-            ratio = quarterHourlyWaterDifference[i] / totalWaterDifference
-            quarter_hourly_water_difference[i] = (daily_level_difference * ratio) + random.gauss(0, 0.0001)
-
-        return quarter_hourly_water_difference
-
-    def calculateQuarterHourlyLevel(self, quarterHourlyLevelDerivative):
-        # Calculate the water level for each quarter-hourly sample.
-        level = [0.0]*len(quarterHourlyLevelDerivative)
-        level[0] = self.startingWaterLevel
-
-        for i in range(1, len(quarterHourlyLevelDerivative)):
-            level[i] = level[i-1] + quarterHourlyLevelDerivative[i]
-
-            # Hardcode minimum and maximum water level
-            if level[i] < 0.1:
-                level[i] = 0.1  
-            if level[i] > 2.6:
-                level[i] = 2.6           
-
-        return level
+        return np.where(startingHeight + predicted < 0.2, 0.2 - startingHeight, predicted)
+
+    def calculateQuarterHourlyLevelDifference(self, dailyLevelDifference, quarterHourlyWaterDifference, noise = None):
+        # Split the daily level difference between the samples in proportion to their share of the daily water difference.
+        # If noise isn't given, new gaussian noise is drawn for each sample.
+        # For an ensemble, dailyLevelDifference has one value per row of quarterHourlyWaterDifference.
+        quarterHourlyWaterDifference = np.asarray(quarterHourlyWaterDifference, dtype=float)
+        ratio = quarterHourlyWaterDifference / quarterHourlyWaterDifference.sum(axis=-1, keepdims=True)
+        if noise is None:
+            noise = self.predictors.rng.normal(0, 0.0001, quarterHourlyWaterDifference.shape)
+
+        return (np.asarray(dailyLevelDifference)[..., np.newaxis] * ratio) + noise
+
+    def calculateQuarterHourlyLevel(self, quarterHourlyLevelDerivative, startingLevel = None):
+        # Calculate the water level for each quarter-hourly sample, starting from startingLevel (defaults to startingWaterLevel).
+        # Hardcode minimum and maximum water level
+        if startingLevel is None:
+            startingLevel = self.startingWaterLevel
+        return clampedCumulativeLevel(startingLevel, quarterHourlyLevelDerivative, 0.1, 2.6)
+
+    def simulateDay(self, tolerance : float = None, maxPasses : int = 35):
+        # Repeatedly recalculate the flow rates and levels for the day until they are stable.
+        # tolerance : Stop once no level changes by more than this between passes (m). If None always do maxPasses passes.
+        # maxPasses : The maximum number of passes to do, even if the levels haven't settled.
+        # Returns the quarter-hourly flow rates, the quarter-hourly levels and the number of passes done.
+        # If startingWaterLevel is an array of ensemble members, the result is (members x samples). Every member is stepped
+        # through the day together, members which have settled are frozen, and the pass count is that of the slowest member.
+        startingHeight = np.atleast_1d(np.asarray(self.startingWaterLevel, dtype=float))
+        quarterHourlyFlowRate = self.calculate_quarter_hourly_flow_rate(None).reshape(len(startingHeight), -1)
+        quarterHourlyLevels = np.zeros_like(quarterHourlyFlowRate)
+
+        # Draw the day's noise once, so every pass solves the same equations and the levels can actually settle.
+        dailyNoise = self.predictors.rng.normal(0, self.predictors.std, startingHeight.shape)
+        quarterHourlyNoise = self.predictors.rng.normal(0, 0.0001, quarterHourlyFlowRate.shape)
+
+        # Indices of the members which haven't settled yet.
+        active = np.arange(len(startingHeight))
+
+        passes = 0
+        while passes < maxPasses and len(active) > 0:
+            quarterHourlyWaterDifference = self.calculate_quarter_hourly_water_diff(quarterHourlyFlowRate[active])
+            dailyWaterDifference = quarterHourlyWaterDifference.sum(axis=-1)
+            dailyLevelDifference = self.calculateDailyLevelDerivative(dailyWaterDifference, startingHeight[active], dailyNoise[active])
+            quarterHourlyLevelDifference = self.calculateQuarterHourlyLevelDifference(dailyLevelDifference, quarterHourlyWaterDifference, quarterHourlyNoise[active])
+            levels = self.calculateQuarterHourlyLevel(quarterHourlyLevelDifference, startingHeight[active])
+            quarterHourlyFlowRate[active] = self.calculate_quarter_hourly_flow_rate(levels)
+
+            if tolerance is not None and passes > 0:
+                settled = np.abs(levels - quarterHourlyLevels[active]).max(axis=-1) < tolerance
+            else:
+                settled = np.zeros(len(active), dtype=bool)
+
+            quarterHourlyLevels[active] = levels
+            active = active[~settled]
+            passes += 1
+
+        if np.ndim(self.startingWaterLevel) == 0:
+            return quarterHourlyFlowRate[0], quarterHourlyLevels[0], passes
+
+        return quarterHourlyFlowRate, quarterHourlyLevels, passes
+
+    def iterateDays(self, numberOfDays : int = None, tolerance : float = None, maxPasses : int = 35, firstDay : int = 0):
+        # Generator which simulates one day at a time, carrying the water level at the end of each day into the next.
+        # The pollutants left in the river are carried too, and self.pollutantMass is kept up to date with them as each day is yielded.
+        # self.rainfall (and volumeOfWaterComingFromDamn) can be any iterable, including a generator that never ends,
+        # so only the current day is ever held in memory.
+        # numberOfDays : Stop after this many days. If None, carry on until the rainfall runs out.
+        # firstDay : Index of the first day, e.g. the number of days already generated when extending a dataset.
+        # Yields (day index, dictionary of the day's quarter-hourly columns, number of passes the day needed).
+        rainfall = iter(self.rainfall)
+        damn = iter(self.volumeOfWaterComingFromDamn)
+
+        startingHeight = self.startingWaterLevel
+        day = firstDay
+        while numberOfDays is None or day < firstDay + numberOfDays:
+            dayRainfall = np.fromiter(itertools.islice(rainfall, 96), dtype=float)
+            if len(dayRainfall) < 96:
+                return
+
+            # If the dam releases run out before the rainfall, assume there is no more water coming from the dam.
+            dayDamn = np.zeros(96)
+            releases = np.fromiter(itertools.islice(damn, 96), dtype=float)
+            dayDamn[:len(releases)] = releases
+
+            dg = DataGenerator(numOfSamples=96, rainfall=dayRainfall, startingWaterLevel=startingHeight,
+                               volumeOfWaterComingFromDamn=dayDamn, catchementArea=self.catchementArea, pollutants=self.pollutants, mixingVolume=self.mixingVolume,
+                               property_flooding_level=self.property_flooding_level,
+                               low_lying_land_flooding_level=self.low_lying_land_flooding_level, predictors=self.predictors, metrics=self.metrics)
+            with self.metrics.stage('Simulate day', day=day) as fields:
+                quarterHourlyFlowRate, quarterHourlyLevels, passes = dg.simulateDay(tolerance=tolerance, maxPasses=maxPasses)
+                fields['passes'] = passes
+            self.metrics.count('Days simulated')
+            self.metrics.count('Passes', passes)
+            self.metrics.count('Samples generated', 96)
+
+            columns = {'Precipitation': dayRainfall, 'Flow Rate': quarterHourlyFlowRate, 'Water Level': quarterHourlyLevels}
+            dg.pollutantMass = self.pollutantMass
+            columns.update(dg.calculate_quarter_hourly_concentrations(quarterHourlyFlowRate))
+            self.pollutantMass = dg.pollutantMass
+            yield day, columns, passes
+
+            startingHeight = quarterHourlyLevels[-1]
+            day += 1
+
+    def simulate(self, tolerance : float = None, maxPasses : int = 35):
+        # Simulate every whole day of rainfall in turn, carrying the water level (and the pollutants in the river) at the end of each day into the next.
+        # Returns arrays of the quarter-hourly flow rates and levels, the number of passes each day needed,
+        # and a dictionary of "Concentration <pollutant>" to its quarter-hourly concentrations (empty without pollutants).
+        numberOfDays = self.numOfSamples // 96
+
+        flowRates = np.zeros(numberOfDays * 96)
+        levels = np.zeros(numberOfDays * 96)
+        passesPerDay = np.zeros(numberOfDays, dtype=int)
+        concentrations = {'Concentration ' + name: np.zeros(numberOfDays * 96) for name in self.pollutantNames}
+
+        simulatedDays = 0
+        for i, columns, passes in self.iterateDays(numberOfDays, tolerance=tolerance, maxPasses=maxPasses):
+            day = slice(i*96, (i+1)*96)
+            flowRates[day] = columns['Flow Rate']
+            levels[day] = columns['Water Level']
+            for column in concentrations:
+                concentrations[column][day] = columns[column]
+            passesPerDay[i] = passes
+            simulatedDays += 1
+
+        concentrations = {column: values[:simulatedDays*96] for column, values in concentrations.items()}
+        return flowRates[:simulatedDays*96], levels[:simulatedDays*96], passesPerDay[:simulatedDays], concentrations
+
+    def simulateEnsemble(self, members : int = 100, percentiles : list() = (5, 50, 95), tolerance : float = None, maxPasses : int = 35):
+        # Monte Carlo mode: simulate many stochastic realisations of the same rainfall at once.
+        # The state of every member is carried as a (members x samples) array and all members are stepped through each day together.
+        # Only the summary statistics are kept, so memory doesn't grow with the number of members.
+        # Returns a dataframe with one row per quarter-hourly sample containing the rainfall, the requested percentiles of the
+        # flow rate and water level, and the probability of exceeding the property and low lying land flooding levels.
+        numberOfDays = self.numOfSamples // 96
+        samples = numberOfDays * 96
+
+        flowPercentiles = np.zeros((len(percentiles), samples))
+        levelPercentiles = np.zeros((len(percentiles), samples))
+        propertyFlooding = np.zeros(samples)
+        lowLyingLandFlooding = np.zeros(samples)
+
+        startingHeight = np.full(members, self.startingWaterLevel, dtype=float)
+        for i in range(numberOfDays):
+            day = slice(i*96, (i+1)*96)
+            dg = DataGenerator(numOfSamples=96, rainfall=self.rainfall[day], startingWaterLevel=startingHeight,
+                               volumeOfWaterComingFromDamn=self.volumeOfWaterComingFromDamn[day], catchementArea=self.catchementArea,
+                               property_flooding_level=self.property_flooding_level,
+                               low_lying_land_flooding_level=self.low_lying_land_flooding_level, predictors=self.predictors, metrics=self.metrics)
+            with self.metrics.stage('Simulate day', day=i, members=members) as fields:
+                quarterHourlyFlowRate, quarterHourlyLevels, passes = dg.simulateDay(tolerance=tolerance, maxPasses=maxPasses)
+                fields['passes'] = passes
+            self.metrics.count('Days simulated')
+            self.metrics.count('Passes', passes)
+            self.metrics.count('Samples generated', 96 * members)
+
+            flowPercentiles[:, day] = np.percentile(quarterHourlyFlowRate, percentiles, axis=0)
+            levelPercentiles[:, day] = np.percentile(quarterHourlyLevels, percentiles, axis=0)
+            propertyFlooding[day] = (quarterHourlyLevels >= self.property_flooding_level).mean(axis=0)
+            lowLyingLandFlooding[day] = (quarterHourlyLevels >= self.low_lying_land_flooding_level).mean(axis=0)
+
+            startingHeight = quarterHourlyLevels[:, -1]
+
+        df = pd.DataFrame({'Precipitation': np.asarray(self.rainfall[:samples], dtype=float)})
+        for j, p in enumerate(percentiles):
+            df['Flow Rate P' + str(p)] = flowPercentiles[j]
+        for j, p in enumerate(percentiles):
+            df['Water Level P' + str(p)] = levelPercentiles[j]
+        df['Property Flooding Probability'] = propertyFlooding
+        df['Low Lying Land Flooding Probability'] = lowLyingLandFlooding
+
+        return df
+
+    def openOutput(self, columns : list() = None, startTimestamp : str = DataGeneratorOutput.DEFAULT_START_TIMESTAMP, resume = None):
+        # Open a writer for each of outputFormats in outputDirectory. Days are written with writeDay as they are generated.
+        # resume : The output positions saved in a checkpoint. The existing outputs are appended to instead of overwritten.
+        # columns defaults to outputColumns, so the pollutant concentrations are written too.
+        columns = self.outputColumns() if columns is None else columns
+        if len(self.outputFormats) == 1:
+            return DataGeneratorOutput.createOutput(self.outputFormats[0], self.outputDirectory, columns, startTimestamp, resume)
+        resume = [None] * len(self.outputFormats) if resume is None else resume
+        return DataGeneratorOutput.MultiOutput([DataGeneratorOutput.createOutput(outputFormat, self.outputDirectory, columns, startTimestamp, position)
+                                                for outputFormat, position in zip(self.outputFormats, resume)])
+
+    def saveCheckpoint(self, days : int, level : float, output = None, rainfallTimestamp = None):
+        # Save the state needed to carry on generating after the first `days` days: the last water level, the pollutants in the river,
+        # the random number generator, the models used, the output columns and how far each output had got. Written to a temporary file first so a half-written checkpoint is never read.
+        # rainfallTimestamp : Timestamp of the last rainfall sample used, so a later run can skip the rainfall which has already been used.
+        try:
+            position = None if output is None else output.position()
+        except NotImplementedError:
+            position = None
+        state = {'days': days,
+                 'level': float(level),
+                 'rng': self.predictors.rng.bit_generator.state,
+                 'cacheKey': self.predictors.cacheKey,
+                 'outputFormats': list(self.outputFormats),
+                 'columns': self.outputColumns(),
+                 'pollutantMass': np.ravel(self.pollutantMass).tolist(),
+                 'outputs': position,
+                 'rainfallTimestamp': None if rainfallTimestamp is None else str(np.datetime64(rainfallTimestamp, 'ms'))}
+        path = os.path.join(self.outputDirectory, CHECKPOINT_NAME)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    def loadCheckpoint(self):
+        # Load the checkpoint in outputDirectory. Returns None if there isn't one.
+        # Raises ValueError if the checkpoint can't be carried on from with these predictors, output formats and pollutants.
+        try:
+            with open(os.path.join(self.outputDirectory, CHECKPOINT_NAME), 'r') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        if checkpoint['cacheKey'] != self.predictors.cacheKey:
+            raise ValueError("The checkpoint was generated with different models (" + checkpoint['cacheKey'] + ", now " + self.predictors.cacheKey + ")")
+        if checkpoint['outputFormats'] != list(self.outputFormats):
+            raise ValueError("The checkpoint was written with the output formats " + ", ".join(checkpoint['outputFormats']))
+        if checkpoint['columns'] != self.outputColumns():
+            raise ValueError("The checkpoint was written with the columns " + ", ".join(checkpoint['columns']) + ", now " + ", ".join(self.outputColumns()))
+        if checkpoint['outputs'] is None:
+            raise ValueError("The outputs in the checkpoint can't be appended to")
+        return checkpoint
+
+    def resumeFromCheckpoint(self, checkpoint : dict, rainfallTimestamps = None):
+        # Carry on from a checkpoint: start from its water level, pollutants and random number generator state.
+        # If the timestamps of self.rainfall are given, rainfall up to the checkpoint's last rainfall timestamp is dropped,
+        # so only the new rainfall is simulated. Returns the index of the first new day.
+        self.startingWaterLevel = checkpoint['level']
+        self.pollutantMass = np.array(checkpoint['pollutantMass'], dtype=float)
+        self.predictors.rng.bit_generator.state = checkpoint['rng']
+
+        # The timestamps of the remaining rainfall are kept in self.rainfallTimestamps.
+        # The dam releases line up with the rainfall sample for sample, so the same samples are dropped from them.
+        if rainfallTimestamps is not None and checkpoint['rainfallTimestamp'] is not None:
+            new = np.asarray(rainfallTimestamps) > np.datetime64(checkpoint['rainfallTimestamp'], 'ms')
+            if not hasattr(self.volumeOfWaterComingFromDamn, '__len__'):
+                raise ValueError("Dam releases given as an iterator can't be lined up with the remaining rainfall, so the run can't be resumed")
+            damn = np.asarray(self.volumeOfWaterComingFromDamn, dtype=float)
+            keep = np.ones(len(damn), dtype=bool)
+            keep[:len(new)] = new[:len(damn)]
+            self.volumeOfWaterComingFromDamn = damn[keep].tolist()
+            self.rainfall = np.asarray(self.rainfall, dtype=float)[new].tolist()
+            self.rainfallTimestamps = np.asarray(rainfallTimestamps)[new]
+            self.numOfSamples = len(self.rainfall)
+        return checkpoint['days']
+
+    def openEventIndexes(self, startTimestamp : str = DataGeneratorOutput.DEFAULT_START_TIMESTAMP):
+        # Create an EventIndex for the property and the low lying land flooding levels. Add each day's levels to them as it is generated.
+        return {'Property Flooding': EventIndex(self.property_flooding_level, startTimestamp=startTimestamp),
+                'Low Lying Land Flooding': EventIndex(self.low_lying_land_flooding_level, startTimestamp=startTimestamp)}
+
+    def findFloodEvents(self, quarterHourlyLevels, startTimestamp : str = DataGeneratorOutput.DEFAULT_START_TIMESTAMP):
+        # Index the flood events of a whole generated level series (e.g. from simulate) in one pass.
+        indexes = self.openEventIndexes(startTimestamp)
+        for index in indexes.values():
+            index.add(quarterHourlyLevels, np.asarray(self.rainfall[:len(quarterHourlyLevels)], dtype=float))
+        return indexes
 
     def write_to_qtrhrl_csv(self, quarter_hourly_flow_rate, quarter_hourly_levels):
         # Write the rainfall, flow rate, water difference and water level to a csv file
-        f = open('/home/iain/Desktop/IEL/Data/Generated Data/Quarter Hourly Generated Data.csv', 'w')
+        f = open(os.path.join(self.outputDirectory, DataGeneratorOutput.QUARTER_HOURLY_NAME + '.csv'), 'w')
         writer = csv.writer(f)
         writer.writerow(["Precipitation", "Flow Rate", "Water Level"])
         for i in range(len(quarter_hourly_flow_rate)):
@@ -115,7 +496,7 @@ class DataGenerator():
         # Write the rainfall, flow rate, water difference and water level to a csv file
         samples = len(quarter_hourly_flow_rate)
         numberOfDays = samples // 96
-        f = open('/home/iain/Desktop/IEL/Data/Generated Data/Daily Generated Data.csv', 'w')
+        f = open(os.path.join(self.outputDirectory, DataGeneratorOutput.DAILY_NAME + '.csv'), 'w')
         writer = csv.writer(f)
         # Rainfall is cumulative (total); Flow Rate and Water Levels are both mean values.
         writer.writerow(["Precipitation", "Flow Rate", "Water Level"])
@@ -127,143 +508,306 @@ class DataGenerator():
             writer.writerow(row)
         f.close()
 
-    def read_rainfall_from_SEPA_api(self, stationName : str = "Dippen", samples = 100):
+    def read_rainfall_from_SEPA_api(self, stationName : str = "Dippen", samples = 100, client : SEPAClient = None):
         # Read the rainfall data from the SEPA API
         # Can be provided other stations by changing the stationName parameter.
-
-        # Get the id of the station. This is required to get the data.
-        url = "https://timeseries.sepa.org.uk/KiWIS/KiWIS?service=kisters&type=queryServices&datasource=0&request=getTimeseriesList&station_name=" + stationName + "&format=json"
-        response = urlopen(url)
-        data_json = json.loads(response.read())
-        for entry in data_json:
-            if entry[4] == "15minute.Total" and entry[6] == "Precip": # Get the id of the entry with "15minute.Total" and "Precip"
-                id = entry[3]
-                break
-
-        # Calculate the period to use in the API request.
-        number_of_days = (samples // 96) if (samples % 96 == 0) else (samples // 96) + 1
-        period = "P" + str(number_of_days) + "D"
-
-        # Get the rainfall data.
-        url = "https://timeseries.sepa.org.uk/KiWIS/KiWIS?service=kisters&type=queryServices&datasource=0&request=getTimeseriesValues&ts_id=" + str(id) + "&period=" + period + "&returnfields=Timestamp,%20Value,%20Quality%20Code&format=json"
-        response = urlopen(url)
-        data_json = json.loads(response.read())
-        rainfallData = [x[1] for x in data_json[0]["data"]][0:samples]
+        # The client reuses its connection and caches the station ids and downloaded days, so only missing days are downloaded.
+        # The timestamps of the returned samples are kept in self.rainfallTimestamps.
+        with self.metrics.stage('Read rainfall (SEPA)', station=stationName):
+            if client is None:
+                with SEPAClient() as client:
+                    rows = client.readRainfallRows(stationName, samples)
+            else:
+                rows = client.readRainfallRows(stationName, samples)
+
+        self.rainfallTimestamps = parseTimestamps(pd.Series([row[0] for row in rows], dtype=str))
+        rainfallData = [row[1] for row in rows]
         return rainfallData, len(rainfallData)
 
-    def read_rainfall_from_csv(self, filename, samples):
+    def read_rainfall_from_csv(self, filename, samples, useSidecar : bool = True):
         # Read the rainfall data from a pre-downloaded CSV file. Useful if there's no internet connection available.
-        rainfall = []
-        
-        with open(filename, 'r') as csvfile:
-            csvreader = csv.reader(csvfile, delimiter=';')
-            # Skip the header row
-            next(csvreader)
-            
-            # Read each row of data and extract the rainfall value
-            for row in csvreader:
-                try:
-                    rainfall_value = float(row[1])
-                    rainfall.append(rainfall_value)
-                except ValueError:
-                    # Skip rows that don't have valid rainfall data
-                    pass
-                
+        # The value column is parsed by pandas' C parser in chunks, and reading stops once there are enough valid samples.
+        # Rows without a valid rainfall value are skipped, but their row numbers are kept in self.invalidRainfallRows,
+        # and the timestamps of the returned samples are kept in self.rainfallTimestamps.
+        # The parsed rows are saved to a .npy sidecar file next to the CSV, which later runs memory-map instead of parsing the CSV again.
+        with self.metrics.stage('Read rainfall (CSV)') as fields:
+            rows = self.read_rainfall_sidecar(filename, samples) if useSidecar else None
+            fields['sidecar'] = rows is not None
+            if rows is None:
+                rows, complete = self.parse_rainfall_csv(filename, samples)
+                if useSidecar:
+                    self.write_rainfall_sidecar(filename, rows, complete)
+
+        # Skip rows that don't have valid rainfall data
+        valid = ~np.isnan(rows['Value'])
+        self.invalidRainfallRows = np.flatnonzero(~valid)
+
         # Truncate the data to the specified number of samples
-        rainfall = rainfall[:samples]
-        
+        validRows = np.flatnonzero(valid)[:samples]
+        self.invalidRainfallRows = self.invalidRainfallRows[self.invalidRainfallRows < (validRows[-1] if len(validRows) > 0 else len(rows))]
+        self.rainfallTimestamps = np.array(rows['Timestamp'][validRows])
+        rainfall = rows['Value'][validRows].tolist()
+
         # Return the data and its length
         return rainfall, len(rainfall)
+
+    def parse_rainfall_csv(self, filename, samples, chunkSize : int = 100000):
+        # Parse the timestamp and value columns of a semicolon-delimited SEPA export until `samples` valid values have been read.
+        # Returns a structured array of the parsed rows (invalid values are NaN) and whether the whole file was read.
+        chunks = []
+        validCount = 0
+        complete = True
+        reader = pd.read_csv(filename, sep=';', usecols=[0, 1], header=0, names=['Timestamp', 'Value'],
+                             dtype={'Timestamp': str}, chunksize=max(min(samples, chunkSize), 1), engine='c')
+        with reader:
+            for chunk in reader:
+                values = chunk['Value']
+                # If any value isn't a number the column is read as strings, so convert it (invalid values become NaN).
+                if not pd.api.types.is_numeric_dtype(values):
+                    values = pd.to_numeric(values, errors='coerce')
+
+                rows = np.zeros(len(chunk), dtype=RAINFALL_SIDECAR_DTYPE)
+                rows['Timestamp'] = parseTimestamps(chunk['Timestamp'])
+                rows['Value'] = values.to_numpy(dtype=float, na_value=np.nan)
+                chunks.append(rows)
+
+                validCount += np.count_nonzero(~np.isnan(rows['Value']))
+                if validCount >= samples:
+                    complete = False
+                    break
+
+        if len(chunks) == 0:
+            return np.zeros(0, dtype=RAINFALL_SIDECAR_DTYPE), complete
+        return np.concatenate(chunks), complete
+
+    def read_rainfall_sidecar(self, filename, samples):
+        # Memory-map the sidecar of a rainfall CSV, if it is up to date and has enough samples. Otherwise return None.
+        try:
+            with open(filename + '.rainfall.json', 'r') as f:
+                metadata = json.load(f)
+            stat = os.stat(filename)
+            if metadata['size'] != stat.st_size or metadata['mtime_ns'] != stat.st_mtime_ns:
+                return None
+            rows = np.load(filename + '.rainfall.npy', mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return None
+
+        if not metadata['complete'] and np.count_nonzero(~np.isnan(rows['Value'])) < samples:
+            return None
+        return rows
+
+    def write_rainfall_sidecar(self, filename, rows, complete):
+        # Save the parsed rows next to the CSV, along with the size and modification time of the CSV they were parsed from.
+        try:
+            stat = os.stat(filename)
+            np.save(filename + '.rainfall.npy', rows)
+            with open(filename + '.rainfall.json', 'w') as f:
+                json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'rows': len(rows), 'complete': complete}, f)
+        except OSError:
+            # The sidecar is only a cache, so it doesn't matter if it can't be written (e.g. a read-only directory).
+            pass
     
-    def simplifyData(self, csvFileName, outputFilePath):
-        # Read the data from the csv file and save to a pandas dataframe
-        df = pd.read_csv(csvFileName, sep=',')
+    def simplifyData(self, csvFileName, outputFilePath, chunkSize : int = None, writeCodes : bool = False):
+        # Simplify the generated data into categories:
+            # Precipitation is "Dry" if there is no rainfall, "Light Rainfall" if it is below the mean of the non-zero rainfall and "Heavy Rainfall" otherwise
+            # Flow Rate is "Slow" below the bottom quartile, "Steady" between the bottom and top quartile and "Fast" above the top quartile
+            # Water Level is "Low" below the bottom quartile, "Medium" between the bottom and top quartile and "High" above the top quartile
+        # chunkSize : If given, the file is processed chunkSize rows at a time so it never has to fit in memory.
+        #             The first pass calculates the rainfall mean and the quartiles (using a mergeable quantile sketch),
+        #             and the second pass labels each chunk and appends it to the output file.
+        # writeCodes : Write the integer code of each category (e.g. 0 = "Dry") instead of its name.
+        with self.metrics.stage('Simplify data', file=os.path.basename(csvFileName)):
+            self.simplifyFile(csvFileName, outputFilePath, chunkSize, writeCodes)
+
+    def simplifyFile(self, csvFileName, outputFilePath, chunkSize : int = None, writeCodes : bool = False):
+        # See simplifyData.
+        columns = ['Precipitation', 'Flow Rate', 'Water Level']
+
+        if chunkSize is None:
+            # Read the data from the csv file and save to a pandas dataframe
+            df = pd.read_csv(csvFileName, sep=',')
+
+            # Calculate the mean of the rainfall excluding where the rainfall is 0
+            temp = df[df['Precipitation'] != 0]
+            mean = temp['Precipitation'].mean()
+
+            # Calculate the bottom quartile and top quartile of the flow rate and the water level
+            flowQuartiles = (df['Flow Rate'].quantile(0.25), df['Flow Rate'].quantile(0.75))
+            levelQuartiles = (df['Water Level'].quantile(0.25), df['Water Level'].quantile(0.75))
+
+            # Save the simplified data to a csv file
+            simplified = simplifyChunk(df, mean, flowQuartiles, levelQuartiles)
+            if writeCodes:
+                simplified = simplified.apply(lambda column: column.cat.codes)
+            simplified.to_csv(outputFilePath, index=False)
+            return
+
+        # First pass: the rainfall mean and the flow rate and water level quartiles.
+        rainfallTotal = 0.0
+        rainfallCount = 0
+        flowSketch = QuantileSketch()
+        levelSketch = QuantileSketch()
+        for df in pd.read_csv(csvFileName, sep=',', usecols=columns, chunksize=chunkSize):
+            rainfall = df['Precipitation'].to_numpy(dtype=float)
+            rainfall = rainfall[(rainfall != 0) & ~np.isnan(rainfall)]
+            rainfallTotal += rainfall.sum()
+            rainfallCount += len(rainfall)
+            flowSketch.add(df['Flow Rate'].to_numpy(dtype=float))
+            levelSketch.add(df['Water Level'].to_numpy(dtype=float))
+
+        mean = rainfallTotal / rainfallCount if rainfallCount > 0 else np.nan
+        flowQuartiles = (flowSketch.quantile(0.25), flowSketch.quantile(0.75))
+        levelQuartiles = (levelSketch.quantile(0.25), levelSketch.quantile(0.75))
+
+        # Second pass: label each chunk and append it to the output file.
+        header = True
+        for df in pd.read_csv(csvFileName, sep=',', usecols=columns, chunksize=chunkSize):
+            simplified = simplifyChunk(df, mean, flowQuartiles, levelQuartiles)
+            if writeCodes:
+                simplified = simplified.apply(lambda column: column.cat.codes)
+            simplified.to_csv(outputFilePath, index=False, columns=columns, header=header, mode='w' if header else 'a')
+            header = False
 
-        # Calculate the bottom quartile and top quartile of the rainfall excluding where the rainfall is 0
-        temp = df[df['Precipitation'] != 0]
-        mean = temp['Precipitation'].mean()
+if __name__ == "__main__":
 
-        # Calculate the bottom quartile and top quartile of the flow rate
-        bottomQuartileFlow = df['Flow Rate'].quantile(0.25)
-        topQuartileFlow = df['Flow Rate'].quantile(0.75)
+    # Number of days to generate data for. There is no upper limit when the rainfall is repeated.
+    numberOfDays = 3125
+    samples = 96 * numberOfDays
+    assert numberOfDays > 0, "Number of days must be positive"
 
-        # Calculate the bottom quartile and top quartile of the water level
-        bottomQuartileLevel = df['Water Level'].quantile(0.25)
-        topQuartileLevel = df['Water Level'].quantile(0.75)
+    # If there is less rainfall data than numberOfDays, repeat the rainfall to make up the difference.
+    # Otherwise the number of days is reduced to the amount of rainfall available.
+    repeatRainfall = False
 
-        # Create a new dataframe with simplified data:
-            # "Low" is used if the value is below the bottom quartile
-            # "Medium" is used if the value is between the bottom and top quartile
-            # "High" is used if the value is above the top quartile
+    # Where to write the generated data, and which formats to write it in ("csv", "npy" and/or "parquet").
+    outputDirectory = GENERATED_DATA_DIRECTORY
+    outputFormats = ["csv"]
 
-        df2 = pd.DataFrame(columns=['Precipitation', 'Flow Rate', 'Water Level'])
-        df2['Precipitation'] = df['Precipitation'].apply(lambda x: "Dry" if x == 0 else ("Light Rainfall" if x < mean else "Heavy Rainfall"))
-        df2['Flow Rate'] = df['Flow Rate'].apply(lambda x: "Slow" if x < bottomQuartileFlow else ("Steady" if x < topQuartileFlow else "Fast"))
-        df2['Water Level'] = df['Water Level'].apply(lambda x: "Low" if x < bottomQuartileLevel else ("Medium" if x < topQuartileLevel else "High"))
+    # The simulator state is saved to a checkpoint in outputDirectory after each day. If resume is True and there is a checkpoint,
+    # carry on from the end of the existing data instead of starting again: only rainfall after the last rainfall used is simulated,
+    # and the new days are appended to the existing outputs (csv and npy only).
+    resume = False
 
-        # Save the simplified data to a csv file
-        df2.to_csv(outputFilePath, index=False)     
+    # Pollutants carried into the river, as (Source, Pollutant, Concentration) tuples. The source is "Damn" or "Rainfall".
+    # The concentration of each pollutant in the river is written as a "Concentration <pollutant>" column.
+    # e.g. [("Damn", "Nitrate", 2.5), ("Rainfall", "Nitrate", 0.5), ("Damn", "Phosphate", 0.1)]
+    pollutants = None
 
-if __name__ == "__main__":
+    # The stage times, predictor call counts and passes per day are written to this JSON lines file (None to turn them off).
+    # If profilePath is set, the run is also profiled with cProfile and the stats are saved there.
+    metricsPath = os.path.join(outputDirectory, "metrics.jsonl")
+    profilePath = None
+    metrics = Metrics(metricsPath, profilePath) if metricsPath is not None or profilePath is not None else None
 
-    # Number of days to generate data for. Must be between 1 and 3125.
-    numberOfDays = 3125
-    samples = 96 * numberOfDays
-    assert numberOfDays <= 3125 and numberOfDays > 0, "Number of days must be between 1 and 3125"
+    # Key of models saved by Predictors.update (e.g. retrained on the latest readings). None uses the models fitted to the real data.
+    modelCacheKey = None
 
     # Train the ML models to be used later.
     print("1: Initialising ML Model")
-    predictor = Predictors()
+    predictor = Predictors(metrics=metrics, cacheKey=modelCacheKey)
 
     # Attempt to read the rainfall data from the SEPA API. If this fails, read the data from the csv file.
+    dg = DataGenerator(numOfSamples=samples, predictors=predictor, pollutants=pollutants, outputDirectory=outputDirectory, outputFormats=outputFormats)
     try:
         print("2: Attempting to read rainfall data from SEPA API")
-        rainfall, samples = DataGenerator(numOfSamples=samples, predictors=predictor).read_rainfall_from_SEPA_api(samples = samples)
-    except:
-        print("2: Couldn't access SEPA API, reading local CSV")
-        rainfall, samples = DataGenerator(numOfSamples=samples, predictors=predictor).read_rainfall_from_csv("/home/iain/Desktop/IEL/Data/Quater_Hourly_Readings/Quarter_Hourly_Precipitation.csv", samples = samples)
-    
+        rainfall, samples = dg.read_rainfall_from_SEPA_api(samples = samples)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        print("2: Couldn't access SEPA API (" + str(e) + "), reading local CSV")
+        rainfall, samples = dg.read_rainfall_from_csv("/home/iain/Desktop/IEL/Data/Quater_Hourly_Readings/Quarter_Hourly_Precipitation.csv", samples = samples)
+
     # Initialise the starting water level.
     starting_height = 0.5
+    dg.rainfall = rainfall
+    dg.numOfSamples = samples
+    dg.startingWaterLevel = starting_height
+
+    # Pick up from the checkpoint, dropping the rainfall which has already been simulated.
+    firstDay = 0
+    checkpoint = dg.loadCheckpoint() if resume else None
+    if checkpoint is not None:
+        firstDay = dg.resumeFromCheckpoint(checkpoint, dg.rainfallTimestamps)
+        rainfall, samples = dg.rainfall, dg.numOfSamples
+        print("   Resuming after day %d with %d new samples" % (firstDay, samples))
 
     # Might not have been able to read the exact number of samples requested. Update the number of days to generate.
-    numberOfDays = samples // 96
+    rainfallTimestamps = dg.rainfallTimestamps
+    if repeatRainfall:
+        dg.rainfall = itertools.cycle(rainfall[:(samples // 96) * 96])
+        rainfallTimestamps = None
+    else:
+        numberOfDays = samples // 96
 
-    # Keep a list of all flow rates and levels generated.
-    all_flow_rates = []
-    all_levels = []
+    # Stop iterating a day once its levels change by less than this (m), or after maxPasses passes.
+    tolerance = 0.001
+    maxPasses = 35
 
+    # Keep running totals of how many passes the days needed, rather than a list which grows with the number of days.
+    total_passes = 0
+    min_passes = maxPasses
+    max_passes = 0
+
+    # Each day is written to the CSV files as soon as it has been generated, so memory use doesn't grow with the number of days.
     # tqdm is just used to get a loading bar in the terminal.
-    print("3: Generating Data")
-    for i in tqdm(range(numberOfDays)):
-        dg = DataGenerator(numOfSamples=96, rainfall=rainfall[i*96:(i+1)*96], startingWaterLevel=starting_height, predictors=predictor)
-        quarter_hourly_flow_rate = dg.calculate_quarter_hourly_flow_rate(None)
-
-        # Loop through 35 times, to get the measurements to be stable.
-        for i in range(35):
-            quarter_hourly_water_difference = dg.calculate_quarter_hourly_water_diff(quarter_hourly_flow_rate)
-            daily_water_difference = sum(quarter_hourly_water_difference)
-            daily_level_difference = dg.calculateDailyLevelDerivative(daily_water_difference, starting_height)
-            quarter_hourly_level_difference = dg.calculateQuarterHourlyLevelDifference(daily_level_difference, quarter_hourly_water_difference)
-            quarter_hourly_levels = dg.calculateQuarterHourlyLevel(quarter_hourly_level_difference)
-            quarter_hourly_flow_rate = dg.calculate_quarter_hourly_flow_rate(quarter_hourly_levels)
-
-        quarter_hourly_water_difference = dg.calculate_quarter_hourly_water_diff(quarter_hourly_flow_rate)
-        daily_water_difference = sum(quarter_hourly_water_difference)
-        daily_level_difference = quarter_hourly_levels[-1] - starting_height
-        
-        starting_height = quarter_hourly_levels[-1]
-        all_flow_rates += quarter_hourly_flow_rate
-        all_levels += quarter_hourly_levels
-
-    # Finally write to the CSV files.
-    print("4: Writing Data to CSV")
-    dg = DataGenerator(numOfSamples=samples, rainfall=rainfall, predictors=predictor)
-    dg.write_to_qtrhrl_csv(all_flow_rates, all_levels)
-    dg.write_to_day_csv(all_flow_rates, all_levels)
-    
-    print("5: Creating Simplified Data")
-    dg.simplifyData("/home/iain/Desktop/IEL/Data/Generated Data/Quarter Hourly Generated Data.csv", "/home/iain/Desktop/IEL/Data/Generated Data/Simplified Generated Data/Simplified Quarter Hourly Data.csv")
-    dg.simplifyData("/home/iain/Desktop/IEL/Data/Generated Data/Daily Generated Data.csv", "/home/iain/Desktop/IEL/Data/Generated Data/Simplified Generated Data/Simplified Daily Data.csv")
-    
-    print("6: Done")
\ No newline at end of file
+    print("3: Generating Data and Writing to " + ", ".join(outputFormats))
+    dg.numOfSamples = numberOfDays * 96
+    os.makedirs(outputDirectory, exist_ok=True)
+
+    # Timestamp the outputs from the first rainfall sample when its time is known (from SEPA or the CSV), rather than from 2000-01-01.
+    # When resuming, the first new sample is the start of day firstDay, so the outputs start firstDay days before it.
+    firstNewTimestamp = np.datetime64(DataGeneratorOutput.DEFAULT_START_TIMESTAMP, 's') + np.timedelta64(firstDay, 'D')
+    if dg.rainfallTimestamps is not None and len(dg.rainfallTimestamps) > 0:
+        firstNewTimestamp = np.datetime64(dg.rainfallTimestamps[0], 's')
+    startTimestamp = str(firstNewTimestamp - np.timedelta64(firstDay, 'D'))
+
+    # The flood events are indexed as the days are generated, so they can be queried without reading the generated data again.
+    # They start at the first new rainfall sample, so countsPerYear gives the real calendar years.
+    # When resuming, the saved indexes are carried on if they cover exactly the days already generated.
+    eventIndexes = dg.openEventIndexes(str(firstNewTimestamp))
+    for name in eventIndexes if firstDay > 0 else []:
+        path = os.path.join(outputDirectory, name + " Events.npz")
+        saved = EventIndex.load(path) if os.path.exists(path) else None
+        if saved is not None and saved.samples == firstDay * 96:
+            eventIndexes[name] = saved
+        else:
+            print("   The saved " + name + " events don't match the checkpoint, so only the new days will be indexed")
+
+    with dg.openOutput(startTimestamp=startTimestamp, resume=None if checkpoint is None else checkpoint['outputs']) as output:
+        for day, columns, passes in tqdm(dg.iterateDays(numberOfDays, tolerance=tolerance, maxPasses=maxPasses, firstDay=firstDay), total=numberOfDays):
+            with dg.metrics.stage('Write output', day=day):
+                output.writeDay(columns)
+            for index in eventIndexes.values():
+                index.add(columns['Water Level'], columns['Precipitation'])
+            total_passes += passes
+            min_passes = min(min_passes, passes)
+            max_passes = max(max_passes, passes)
+
+            # Save the state after every day, so the run can be resumed from here if it is stopped.
+            lastTimestamp = None if rainfallTimestamps is None else rainfallTimestamps[(day - firstDay) * 96 + 95]
+            dg.saveCheckpoint(day + 1, columns['Water Level'][-1], output, lastTimestamp)
+
+    if numberOfDays > 0:
+        print("   Passes per day: mean %.1f, min %d, max %d (%d of %d possible passes skipped)" % (
+            total_passes / numberOfDays, min_passes, max_passes, maxPasses*numberOfDays - total_passes, maxPasses*numberOfDays))
+
+    for name, index in eventIndexes.items():
+        index.save(os.path.join(outputDirectory, name + " Events.npz"))
+        longest = index.longest()
+        print("   %s (%.2fm): %d events, %.1f per year, longest %.1f hours" % (
+            name, index.threshold, len(index), len(index) / index.years() if index.samples > 0 else 0, 0 if longest is None else longest['Duration']))
+
+    # The simplified data is created from the CSV files.
+    if "csv" in outputFormats:
+        print("4: Creating Simplified Data")
+        simplifiedDirectory = os.path.join(outputDirectory, "Simplified Generated Data")
+        os.makedirs(simplifiedDirectory, exist_ok=True)
+        dg.simplifyData(os.path.join(outputDirectory, "Quarter Hourly Generated Data.csv"), os.path.join(simplifiedDirectory, "Simplified Quarter Hourly Data.csv"))
+        dg.simplifyData(os.path.join(outputDirectory, "Daily Generated Data.csv"), os.path.join(simplifiedDirectory, "Simplified Daily Data.csv"))
+
+    if metrics is not None:
+        summary = metrics.summary()
+        metrics.close()
+        print("   " + ", ".join("%s %.2fs" % (name, stage['seconds']) for name, stage in summary['stages'].items()))
+        if 'samplesPerSecond' in summary:
+            print("   %.0f samples per second" % summary['samplesPerSecond'])
+
+    print("5: Done")
\ No newline at end of file
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+from DataGeneratorOutput import DEFAULT_START_TIMESTAMP
+
+# Layout of each event in an EventIndex. Start and End are sample numbers (End is the first sample back below the threshold).
+EVENT_DTYPE = np.dtype([('Start', 'int64'), ('End', 'int64'), ('Peak', 'float64'), ('Rainfall', 'float64')])
+
+# Average number of days in a year, used to convert the length of a series to years.
+DAYS_PER_YEAR = 365.25
+
+def findEvents(levels, threshold : float, rainfall = None):
+    # Find every run of samples at or above the threshold in one vectorised pass.
+    # Returns an EVENT_DTYPE array with the start and end sample, peak level and total rainfall of each run.
+    levels = np.asarray(levels, dtype=float)
+    rainfall = np.zeros(len(levels)) if rainfall is None else np.asarray(rainfall, dtype=float)
+
+    # +1 where the level rises to the threshold and -1 where it falls below it. Padding with False closes runs at either end.
+    above = np.concatenate([[False], levels >= threshold, [False]])
+    change = np.diff(above.astype(np.int8))
+    starts = np.flatnonzero(change == 1)
+    ends = np.flatnonzero(change == -1)
+
+    events = np.zeros(len(starts), dtype=EVENT_DTYPE)
+    if len(starts) == 0:
+        return events
+    events['Start'] = starts
+    events['End'] = ends
+
+    # Peak of each run. The padding value makes every end index valid for reduceat.
+    events['Peak'] = np.maximum.reduceat(np.append(levels, -np.inf), np.ravel(np.column_stack([starts, ends])))[::2]
+    totalRainfall = np.concatenate([[0.0], np.cumsum(rainfall)])
+    events['Rainfall'] = totalRainfall[ends] - totalRainfall[starts]
+    return events
+
+class EventIndex:
+    # Compact index of the times the water level is at or above a flooding level, built as the series is generated.
+    # Only the events are kept, so questions such as "how many floods per year" or "how long was the longest flood" are answered
+    # without re-reading the generated data. Levels can be added in chunks of any size (e.g. one day at a time);
+    # an event which is still going at the end of a chunk is carried into the next.
+
+    def __init__(self,
+                threshold : float,                                  # The flooding level (m)
+                samplesPerDay : int = 96,                           # Number of samples per day
+                startTimestamp : str = DEFAULT_START_TIMESTAMP):    # The time of the first sample
+        self.threshold = threshold
+        self.samplesPerDay = samplesPerDay
+        self.startTimestamp = startTimestamp
+        self.samples = 0
+        self.chunks = []
+        self.openEvent = None
+
+    def add(self, levels, rainfall = None):
+        # Add the next chunk of the level series (and the matching rainfall).
+        levels = np.asarray(levels, dtype=float)
+        # An empty chunk says nothing about whether an open event has finished.
+        if len(levels) == 0:
+            return
+        events = findEvents(levels, self.threshold, rainfall)
+        events['Start'] += self.samples
+        events['End'] += self.samples
+
+        # An event carried from the last chunk continues if this chunk starts above the threshold.
+        if self.openEvent is not None:
+            if len(events) > 0 and events['Start'][0] == self.samples:
+                events['Start'][0] = self.openEvent['Start']
+                events['Peak'][0] = max(events['Peak'][0], self.openEvent['Peak'])
+                events['Rainfall'][0] += self.openEvent['Rainfall']
+            else:
+                self.chunks.append(np.array([self.openEvent], dtype=EVENT_DTYPE))
+            self.openEvent = None
+
+        self.samples += len(levels)
+
+        # An event which is still going at the end of the chunk isn't finished yet.
+        if len(events) > 0 and events['End'][-1] == self.samples:
+            self.openEvent = events[-1].copy()
+            events = events[:-1]
+
+        if len(events) > 0:
+            self.chunks.append(events)
+
+    @property
+    def events(self):
+        # Every event so far. An event which is still going is included, ending at the last sample.
+        # The finished events are joined once and kept that way, so repeated queries don't join them again.
+        if len(self.chunks) > 1:
+            self.chunks = [np.concatenate(self.chunks)]
+        chunks = self.chunks + ([np.array([self.openEvent], dtype=EVENT_DTYPE)] if self.openEvent is not None else [])
+        return np.concatenate(chunks) if len(chunks) > 0 else np.zeros(0, dtype=EVENT_DTYPE)
+
+    def __len__(self):
+        return len(self.events)
+
+    def years(self):
+        return self.samples / (self.samplesPerDay * DAYS_PER_YEAR)
+
+    def timestamps(self, samples):
+        # Convert sample numbers to timestamps.
+        sampleLength = np.timedelta64(86400 // self.samplesPerDay, 's')
+        return np.datetime64(self.startTimestamp, 's') + np.asarray(samples) * sampleLength
+
+    def toDataFrame(self):
+        # The events as a dataframe with their start and end times, duration (hours), peak level and total rainfall (mm).
+        events = self.events
+        return pd.DataFrame({'Start': self.timestamps(events['Start']),
+                             'End': self.timestamps(events['End']),
+                             'Duration': (events['End'] - events['Start']) * 24 / self.samplesPerDay,
+                             'Peak': events['Peak'],
+                             'Rainfall': events['Rainfall']})
+
+    def countsPerYear(self):
+        # Number of events starting in each calendar year covered by the series (including years without any).
+        if self.samples == 0:
+            return pd.Series(dtype=int, name='Events')
+        years = self.timestamps(self.events['Start']).astype('datetime64[Y]').astype(int) + 1970
+        first = int(self.timestamps(0).astype('datetime64[Y]').astype(int)) + 1970
+        last = int(self.timestamps(self.samples - 1).astype('datetime64[Y]').astype(int)) + 1970
+        counts = np.bincount(years - first, minlength=last - first + 1)
+        return pd.Series(counts, index=pd.Index(np.arange(first, last + 1), name='Year'), name='Events')
+
+    def returnPeriod(self, level : float = None):
+        # Average number of years between events which peak at or above the level (defaults to the threshold).
+        # Levels below the threshold can't be estimated from the index. Returns inf if no event has reached the level.
+        level = self.threshold if level is None else level
+        if level < self.threshold:
+            raise ValueError("The return period can only be estimated for levels at or above the threshold (" + str(self.threshold) + "m)")
+        count = np.count_nonzero(self.events['Peak'] >= level)
+        return self.years() / count if count > 0 else np.inf
+
+    def returnPeriods(self):
+        # The return period of each event's peak, from the largest peak down (the nth largest peak is reached every years / n years).
+        peaks = np.sort(self.events['Peak'])[::-1]
+        return pd.DataFrame({'Peak': peaks, 'Return Period': self.years() / np.arange(1, len(peaks) + 1)})
+
+    def longest(self):
+        # The longest event, as a row of toDataFrame. None if there are no events.
+        events = self.events
+        if len(events) == 0:
+            return None
+        return self.toDataFrame().iloc[int(np.argmax(events['End'] - events['Start']))]
+
+    def save(self, path : str):
+        np.savez(path, events=self.events, threshold=self.threshold, samples=self.samples, samplesPerDay=self.samplesPerDay,
+                 startTimestamp=self.startTimestamp, open=self.openEvent is not None)
+
+    @classmethod
+    def load(cls, path : str):
+        with np.load(path) as data:
+            index = cls(float(data['threshold']), int(data['samplesPerDay']), str(data['startTimestamp']))
+            index.samples = int(data['samples'])
+            events = data['events']
+            if bool(data['open']):
+                index.openEvent = events[-1].copy()
+                events = events[:-1]
+            index.chunks = [events] if len(events) > 0 else []
+        return index
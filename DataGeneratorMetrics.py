@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import cProfile
+import contextlib
+
+class Metrics:
+    # Collects the wall time of each stage of a run (e.g. model loading, rainfall ingest, the day loop, file output),
+    # call counts (e.g. of the predictor methods) and per-day values such as the number of passes.
+    # Each finished stage, each recorded event and a final summary are written as one JSON object per line to `path`.
+    # If profilePath is given the whole run is also profiled with cProfile, and the stats are saved there on close.
+
+    enabled = True
+
+    def __init__(self,
+                path : str = None,              # JSON lines file to write the metrics to. None keeps them in memory only
+                profilePath : str = None):      # File to save cProfile stats to (open with pstats or snakeviz)
+        self.path = path
+        self.profilePath = profilePath
+        self.stageTimes = {}
+        self.stageCalls = {}
+        self.counts = {}
+        self.start = time.perf_counter()
+
+        self.file = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory != '':
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(path, 'a')
+
+        self.profiler = None
+        if profilePath is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name : str, **fields):
+        # Time a block of code. Stages with the same name are added together in the summary.
+        # Yields the dictionary of fields written with the stage, so values only known at the end (e.g. passes) can be added to it.
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            seconds = time.perf_counter() - start
+            self.stageTimes[name] = self.stageTimes.get(name, 0.0) + seconds
+            self.stageCalls[name] = self.stageCalls.get(name, 0) + 1
+            self.record('stage', stage=name, seconds=seconds, **fields)
+
+    def count(self, name : str, n : int = 1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def record(self, event : str, **fields):
+        # Write one event to the metrics file.
+        if self.file is not None:
+            fields = {name: value.item() if hasattr(value, 'item') else value for name, value in fields.items()}
+            self.file.write(json.dumps(dict({'event': event, 'time': time.time()}, **fields)) + '\n')
+
+    def summary(self):
+        summary = {'seconds': time.perf_counter() - self.start,
+                   'stages': {name: {'seconds': self.stageTimes[name], 'calls': self.stageCalls[name]} for name in self.stageTimes},
+                   'counts': dict(self.counts)}
+        if self.stageTimes.get('Simulate day', 0) > 0:
+            summary['samplesPerSecond'] = self.counts.get('Samples generated', 0) / self.stageTimes['Simulate day']
+        if self.counts.get('Days simulated', 0) > 0:
+            summary['passesPerDay'] = self.counts.get('Passes', 0) / self.counts['Days simulated']
+        return summary
+
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profilePath)
+            self.profiler = None
+        if self.file is not None:
+            self.record('summary', **self.summary())
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        # Open files and profilers can't be sent to worker processes, so workers get a copy which only counts in memory.
+        state = self.__dict__.copy()
+        state['file'] = None
+        state['profiler'] = None
+        return state
+
+class NullMetrics(Metrics):
+    # Metrics which records nothing. Used when no metrics are wanted, so the instrumentation costs next to nothing.
+
+    enabled = False
+
+    def __init__(self):
+        pass
+
+    def stage(self, name : str, **fields):
+        return NULL_STAGE
+
+    def count(self, name : str, n : int = 1):
+        pass
+
+    def record(self, event : str, **fields):
+        pass
+
+    def summary(self):
+        return {}
+
+    def close(self):
+        pass
+
+    def __getstate__(self):
+        return {}
+
+# A do-nothing context manager, shared by every NullMetrics stage so none has to be created. Fields added to it are never read.
+NULL_STAGE = contextlib.nullcontext({})
+
+# The default metrics of DataGenerator and Predictors.
+NULL_METRICS = NullMetrics()
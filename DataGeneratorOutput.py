@@ -0,0 +1,275 @@
+import os
+import struct
+import numpy as np
+import pandas as pd
+
+# The columns written for every generated sample, in order.
+OUTPUT_COLUMNS = ['Precipitation', 'Flow Rate', 'Water Level']
+
+# Number of decimal places each column is rounded to in the CSV files. Columns not listed are rounded to 3 decimal places.
+DECIMAL_PLACES = {'Precipitation': 1}
+
+# Columns which are totalled (rather than averaged) when calculating the daily values.
+DAILY_TOTAL_COLUMNS = ['Precipitation']
+
+# File names (without extension) of the quarter-hourly and daily outputs inside the output directory.
+QUARTER_HOURLY_NAME = 'Quarter Hourly Generated Data'
+DAILY_NAME = 'Daily Generated Data'
+
+# The time of the first generated sample, used for the timestamps of the binary outputs.
+DEFAULT_START_TIMESTAMP = '2000-01-01T00:00:00'
+
+# Total size of the header written at the start of each streamed .npy file (must be a multiple of 64).
+NPY_HEADER_SIZE = 128
+
+def dailyValues(columns : dict, samplesPerDay : int = 96):
+    # Reduce each quarter-hourly column to one value per day.
+    # Rainfall is cumulative (total); all other columns (e.g. Flow Rate and Water Level) are mean values.
+    daily = {}
+    for name, values in columns.items():
+        values = np.asarray(values, dtype=float).reshape(-1, samplesPerDay)
+        daily[name] = values.sum(axis=1) if name in DAILY_TOTAL_COLUMNS else values.mean(axis=1)
+    return daily
+
+class Output:
+    # Base class of the output writers. Subclasses implement writeDay and close, and position if they can be resumed.
+
+    def writeDay(self, columns : dict):
+        # columns : Dictionary of column name to the day's quarter-hourly values.
+        raise NotImplementedError
+
+    def position(self):
+        # Flush everything written so far and return what is needed to reopen the output at this point (passed back as `resume`).
+        raise NotImplementedError(type(self).__name__ + " can't be resumed")
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CsvOutput(Output):
+    # Writes the generated data to a quarter-hourly CSV file and a daily CSV file one day at a time,
+    # so the whole run never has to be held in memory.
+    # resume : A position returned by an earlier CsvOutput. The files are cut back to that point and new days are appended to them.
+
+    def __init__(self, quarterHourlyPath : str, dailyPath : str, columns : list() = None, samplesPerDay : int = 96, resume : dict = None):
+        self.columns = OUTPUT_COLUMNS if columns is None else columns
+        self.samplesPerDay = samplesPerDay
+        if resume is None:
+            self.quarterHourlyFile = open(quarterHourlyPath, 'w')
+            self.dailyFile = open(dailyPath, 'w')
+            self.writeHeader(self.quarterHourlyFile)
+            self.writeHeader(self.dailyFile)
+        else:
+            self.quarterHourlyFile = self.reopen(quarterHourlyPath, resume['quarterHourly'])
+            self.dailyFile = self.reopen(dailyPath, resume['daily'])
+
+    def reopen(self, path : str, offset : int):
+        # Open a file to append to, dropping anything written after offset (e.g. days written after the last checkpoint).
+        f = open(path, 'r+')
+        f.truncate(offset)
+        f.seek(offset)
+        return f
+
+    def writeHeader(self, f):
+        f.write(','.join(self.columns) + '\n')
+
+    def writeRows(self, f, columns : dict):
+        # Round each column and write one row per sample. %s of a rounded float gives the same text as csv.writer.
+        rows = np.column_stack([np.round(np.asarray(columns[name], dtype=float), DECIMAL_PLACES.get(name, 3)) for name in self.columns])
+        np.savetxt(f, rows, fmt='%s', delimiter=',')
+
+    def writeDay(self, columns : dict):
+        self.writeRows(self.quarterHourlyFile, columns)
+        self.writeRows(self.dailyFile, dailyValues({name: columns[name] for name in self.columns}, self.samplesPerDay))
+
+    def position(self):
+        self.quarterHourlyFile.flush()
+        self.dailyFile.flush()
+        return {'quarterHourly': self.quarterHourlyFile.tell(), 'daily': self.dailyFile.tell()}
+
+    def close(self):
+        self.quarterHourlyFile.close()
+        self.dailyFile.close()
+
+def npyHeader(dtype, length : int):
+    # Build a fixed size .npy header for a 1-D array, so it can be rewritten in place once the final length is known.
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.dtype(dtype).str, length)
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+class NpyColumnWriter:
+    # Appends values to a 1-D .npy file. The header is written with a length of 0 and corrected when the file is closed.
+    # If length is given, an existing file is reopened and cut back to its first `length` values instead.
+
+    def __init__(self, path : str, dtype, length : int = None):
+        self.dtype = np.dtype(dtype)
+        if length is None:
+            self.length = 0
+            self.file = open(path, 'wb')
+            self.file.write(npyHeader(self.dtype, 0))
+        else:
+            self.length = length
+            self.file = open(path, 'r+b')
+            self.file.truncate(NPY_HEADER_SIZE + length * self.dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        self.file.write(values.tobytes())
+        self.length += len(values)
+
+    def flush(self):
+        # Write the current length into the header, so the file can be loaded as it is.
+        self.file.seek(0)
+        self.file.write(npyHeader(self.dtype, self.length))
+        self.file.seek(0, os.SEEK_END)
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class NpyOutput(Output):
+    # Writes each column to its own typed .npy file, in a "Quarter Hourly Generated Data" and a "Daily Generated Data" directory.
+    # The files can be memory-mapped with loadNpyOutput, so reading a decade of quarter-hourly data doesn't copy or parse anything.
+    # (.npz archives can't be memory-mapped, which is why each column is a separate .npy file.)
+    # resume : A position returned by an earlier NpyOutput. The files are cut back to that many days and new days are appended to them.
+
+    def __init__(self, directory : str, columns : list() = None, startTimestamp : str = DEFAULT_START_TIMESTAMP,
+                 samplesPerDay : int = 96, dtype = np.float32, resume : dict = None):
+        self.columns = OUTPUT_COLUMNS if columns is None else columns
+        self.samplesPerDay = samplesPerDay
+        self.start = np.datetime64(startTimestamp, 's')
+        self.sampleLength = np.timedelta64(86400 // samplesPerDay, 's')
+        self.days = 0 if resume is None else resume['days']
+
+        self.writers = {}
+        for name, samples in [(QUARTER_HOURLY_NAME, samplesPerDay), (DAILY_NAME, 1)]:
+            length = None if resume is None else self.days * samples
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+            self.writers[name] = {column: NpyColumnWriter(os.path.join(directory, name, column + '.npy'), dtype, length) for column in self.columns}
+            self.writers[name]['Timestamp'] = NpyColumnWriter(os.path.join(directory, name, 'Timestamp.npy'), 'datetime64[s]', length)
+
+    def writeDay(self, columns : dict):
+        dayStart = self.start + np.timedelta64(self.days * 86400, 's')
+        daily = dailyValues({name: columns[name] for name in self.columns}, self.samplesPerDay)
+        for column in self.columns:
+            self.writers[QUARTER_HOURLY_NAME][column].append(columns[column])
+            self.writers[DAILY_NAME][column].append(daily[column])
+        self.writers[QUARTER_HOURLY_NAME]['Timestamp'].append(dayStart + np.arange(self.samplesPerDay) * self.sampleLength)
+        self.writers[DAILY_NAME]['Timestamp'].append([dayStart])
+        self.days += 1
+
+    def position(self):
+        for writers in self.writers.values():
+            for writer in writers.values():
+                writer.flush()
+        return {'days': self.days}
+
+    def close(self):
+        for writers in self.writers.values():
+            for writer in writers.values():
+                writer.close()
+
+class ParquetOutput(Output):
+    # Writes "Quarter Hourly Generated Data.parquet" and "Daily Generated Data.parquet" with float32 columns and a timestamp index.
+    # Days are buffered and written as one row group every daysPerRowGroup days. Requires pyarrow.
+
+    def __init__(self, directory : str, columns : list() = None, startTimestamp : str = DEFAULT_START_TIMESTAMP,
+                 samplesPerDay : int = 96, daysPerRowGroup : int = 30):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is required to write parquet files (pip install pyarrow)")
+        self.pyarrow = pyarrow
+
+        self.columns = OUTPUT_COLUMNS if columns is None else columns
+        self.samplesPerDay = samplesPerDay
+        self.daysPerRowGroup = daysPerRowGroup
+        self.start = pd.Timestamp(startTimestamp)
+        self.days = 0
+        self.buffer = []
+
+        schema = pyarrow.schema([(column, pyarrow.float32()) for column in self.columns] + [('Timestamp', pyarrow.timestamp('s'))])
+        schema = schema.with_metadata(self.pandasMetadata())
+        self.writers = {name: pyarrow.parquet.ParquetWriter(os.path.join(directory, name + '.parquet'), schema)
+                        for name in [QUARTER_HOURLY_NAME, DAILY_NAME]}
+
+    def pandasMetadata(self):
+        # Metadata which makes pandas.read_parquet use the Timestamp column as the index.
+        frame = pd.DataFrame({column: np.zeros(0, dtype=np.float32) for column in self.columns},
+                             index=pd.DatetimeIndex([], name='Timestamp', dtype='datetime64[s]'))
+        return self.pyarrow.Schema.from_pandas(frame).metadata
+
+    def writeDay(self, columns : dict):
+        self.buffer.append({column: np.asarray(columns[column]) for column in self.columns})
+        if len(self.buffer) >= self.daysPerRowGroup:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+
+        quarterHourly = {column: np.concatenate([day[column] for day in self.buffer]) for column in self.columns}
+        daily = dailyValues(quarterHourly, self.samplesPerDay)
+
+        firstDay = self.start + pd.Timedelta(days=self.days)
+        days = len(self.buffer)
+        timestamps = {QUARTER_HOURLY_NAME: pd.date_range(firstDay, periods=days * self.samplesPerDay, freq=pd.Timedelta(days=1) / self.samplesPerDay),
+                      DAILY_NAME: pd.date_range(firstDay, periods=days, freq='D')}
+
+        for name, values in [(QUARTER_HOURLY_NAME, quarterHourly), (DAILY_NAME, daily)]:
+            arrays = [self.pyarrow.array(values[column], type=self.pyarrow.float32()) for column in self.columns]
+            arrays.append(self.pyarrow.array(timestamps[name].values.astype('datetime64[s]')))
+            writer = self.writers[name]
+            writer.write_table(self.pyarrow.Table.from_arrays(arrays, schema=writer.schema))
+
+        self.days += days
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
+
+class MultiOutput(Output):
+    # Writes every day to several outputs at once, e.g. CSV and parquet.
+
+    def __init__(self, outputs : list()):
+        self.outputs = outputs
+
+    def writeDay(self, columns : dict):
+        for output in self.outputs:
+            output.writeDay(columns)
+
+    def position(self):
+        return [output.position() for output in self.outputs]
+
+    def close(self):
+        for output in self.outputs:
+            output.close()
+
+def createOutput(outputFormat : str, directory : str, columns : list() = None, startTimestamp : str = DEFAULT_START_TIMESTAMP, resume : dict = None):
+    # Create the writer for one of the output formats: "csv", "npy" or "parquet".
+    # resume : The position of an existing output to append to (csv and npy only).
+    os.makedirs(directory, exist_ok=True)
+    if outputFormat == 'csv':
+        return CsvOutput(os.path.join(directory, QUARTER_HOURLY_NAME + '.csv'), os.path.join(directory, DAILY_NAME + '.csv'), columns, resume=resume)
+    if outputFormat == 'npy':
+        return NpyOutput(directory, columns, startTimestamp, resume=resume)
+    if outputFormat == 'parquet':
+        if resume is not None:
+            raise ValueError("Parquet files can't be appended to, so a parquet output can't be resumed")
+        return ParquetOutput(directory, columns, startTimestamp)
+    raise ValueError("Unknown output format: " + str(outputFormat))
+
+def loadNpyOutput(directory : str, daily : bool = False, mmap_mode : str = 'r'):
+    # Load the columns written by NpyOutput as a dictionary of column name to (memory-mapped) array.
+    path = os.path.join(directory, DAILY_NAME if daily else QUARTER_HOURLY_NAME)
+    return {name[:-4]: np.load(os.path.join(path, name), mmap_mode=mmap_mode) for name in sorted(os.listdir(path)) if name.endswith('.npy')}
@@ -1,13 +1,125 @@
+import os
+import json
+import hashlib
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import random
 import math
 from numpy import dtype
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.model_selection import train_test_split
+from DataGeneratorMetrics import Metrics, NULL_METRICS
+
+# sklearn and matplotlib are only imported when the models are actually fitted or plotted,
+# so loading the fitted models from the cache doesn't need either of them.
+
+# Directory containing the real data from the SEPA API.
+REAL_DATA_DIRECTORY = '/home/iain/Desktop/IEL/Data/Real Data'
+
+# The real data files used to train the models, relative to the real data directory.
+QUARTER_HOURLY_FILES = {'Flow Rate': 'Quater_Hourly_Readings/Quarter Hourly Flow Rate.csv',
+                        'Precipitation': 'Quater_Hourly_Readings/Quarter Hourly Precipitation.csv',
+                        'Water Level': 'Quater_Hourly_Readings/Quarter Hourly Level.csv'}
+DAILY_FILES = {'Flow Rate': 'Daily Aggregates/Daily Mean Flow Rate.csv',
+               'Precipitation': 'Daily Aggregates/Daily Precipitation.csv',
+               'Water Level': 'Daily Aggregates/Daily Mean Level.csv'}
+
+# Settings used when fitting the models. Changing any of these invalidates the model cache.
+FIT_SETTINGS = {'cacheVersion': 2,
+                'flowDegree': 3,
+                'flowLevelRange': [0.2, 2],
+                'levelDegree': 1,
+                'maxWaterDifference': 2000000,
+                'testSize': 0.3,
+                'randomState': 0,
+                'qualityCodes': None}        # Only train on rows where every series has one of these quality codes. None uses every row
+
+# Quality code SEPA uses for a missing value.
+MISSING_QUALITY_CODE = -1
+
+def hashFiles(paths : list(), sha = None):
+    # Hash the names and contents of a list of files.
+    sha = hashlib.sha256() if sha is None else sha
+    for path in paths:
+        sha.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+    return sha
+
+def parseTimestamps(timestamps):
+    # Parse SEPA's UTC ISO timestamps (e.g. 2015-01-01T09:00:00.000Z). numpy's ISO parser is much faster than pandas',
+    # but only handles well formed timestamps, so fall back to pandas (with invalid timestamps becoming NaT) if it fails.
+    try:
+        return timestamps.str.rstrip('Z').to_numpy(dtype=str).astype('datetime64[ms]')
+    except ValueError:
+        return pd.to_datetime(timestamps, format='ISO8601', utc=True, errors='coerce').dt.tz_localize(None).to_numpy(dtype='datetime64[ms]')
+
+def readSEPASeries(path : str, name : str):
+    # Read one SEPA export (#Timestamp;Value;Quality Code) into a dataframe indexed by timestamp,
+    # with the value as a float32 column called name and the quality code as an int16 column called "name Quality Code".
+    df = pd.read_csv(path, sep=';', header=0, usecols=[0, 1, 2], names=['Timestamp', name, name + ' Quality Code'],
+                     dtype={'Timestamp': str, name: np.float32, name + ' Quality Code': np.float32}, engine='c')
+    index = pd.DatetimeIndex(parseTimestamps(df['Timestamp']), name='Timestamp')
+    return pd.DataFrame({name: df[name].to_numpy(),
+                         name + ' Quality Code': df[name + ' Quality Code'].fillna(MISSING_QUALITY_CODE).to_numpy().astype(np.int16)},
+                        index=index)
+
+def loadRealData(files : dict, dataDirectory : str = REAL_DATA_DIRECTORY, storeDirectory : str = None):
+    # Load a set of SEPA exports (e.g. QUARTER_HOURLY_FILES) and align them on their timestamps.
+    # Returns a dataframe indexed by timestamp with a float32 column and an int16 quality code column for each series.
+    # Only timestamps present in every series are kept. The aligned data is saved as a columnar .npz store in storeDirectory
+    # (keyed by a hash of the CSVs), so later loads read the typed arrays directly instead of parsing the CSVs again.
+    paths = [os.path.join(dataDirectory, files[name]) for name in files]
+    storePath = None
+    if storeDirectory is not None:
+        storePath = os.path.join(storeDirectory, 'real-data-' + hashFiles(paths).hexdigest()[:16] + '.npz')
+        try:
+            with np.load(storePath) as store:
+                columns = {name: store[name] for name in store.files if name != 'Timestamp'}
+                return pd.DataFrame(columns, index=pd.DatetimeIndex(store['Timestamp'], name='Timestamp'))
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # Index-aligned merge of the series.
+    merged = pd.concat([readSEPASeries(path, name) for name, path in zip(files, paths)], axis=1, join='inner').sort_index()
+
+    if storePath is not None:
+        os.makedirs(storeDirectory, exist_ok=True)
+        temporaryPath = storePath + '.' + str(os.getpid()) + '.tmp.npz'
+        np.savez(temporaryPath, Timestamp=merged.index.values, **{name: merged[name].to_numpy() for name in merged.columns})
+        os.replace(temporaryPath, storePath)
+
+    return merged
+
+def leastSquaresStatistics(x, y, degree : int, scale : float = 1.0):
+    # The sufficient statistics of a polynomial least squares fit of y against x: X'X, X'y, y'y and the number of rows,
+    # where X has the columns 1, x, x^2, ... x is divided by scale first to keep X'X well conditioned.
+    X = np.vander(np.asarray(x, dtype=float).ravel() / scale, degree + 1, increasing=True)
+    y = np.asarray(y, dtype=float).ravel()
+    return {'XtX': X.T @ X, 'Xty': X.T @ y, 'yty': float(y @ y), 'n': len(y), 'scale': scale}
+
+def combineStatistics(statistics : dict, other : dict, sign : int = 1):
+    # Add (or with sign=-1 remove) the rows summarised by other to/from statistics.
+    return {'XtX': statistics['XtX'] + sign * other['XtX'], 'Xty': statistics['Xty'] + sign * other['Xty'],
+            'yty': statistics['yty'] + sign * other['yty'], 'n': statistics['n'] + sign * other['n'], 'scale': statistics['scale']}
+
+def solveLeastSquares(statistics : dict):
+    # Solve the normal equations. Returns the polynomial coefficients (coefficients[i] is the coefficient of x^i)
+    # and the residual sum of squares of the fit.
+    XtX, Xty = statistics['XtX'], statistics['Xty']
+    scaledCoefficients = np.linalg.lstsq(XtX, Xty, rcond=None)[0]
+    residualSumOfSquares = statistics['yty'] - 2 * scaledCoefficients @ Xty + scaledCoefficients @ XtX @ scaledCoefficients
+    coefficients = scaledCoefficients / statistics['scale'] ** np.arange(len(scaledCoefficients))
+    return coefficients, max(residualSumOfSquares, 0.0)
+
+def qualityMask(data, qualityCodes : list() = None):
+    # Boolean mask of the rows where every series has one of the given quality codes.
+    # If qualityCodes is None, the mask only excludes rows where a value is missing.
+    mask = np.ones(len(data), dtype=bool)
+    for column in data.columns:
+        if column.endswith(' Quality Code'):
+            codes = data[column].to_numpy()
+            mask &= (codes != MISSING_QUALITY_CODE) if qualityCodes is None else np.isin(codes, qualityCodes)
+    return mask
 
 def getRainfallMultiplier(catchmentArea : float = 58.5):
     # Convert the rainfall from mm to m3 for the whole region.
@@ -37,62 +149,138 @@ def calculateWaterAndLevelDifference(dataframe : dtype, daily : bool, catchmentA
 class Predictors:
     # This class will be used to store ML models and functions to generate data based on these models.
 
-    def __init__(self):
+    def __init__(self,
+                seed : int = None,                              # Seed for the random number generator used by the batch functions
+                dataDirectory : str = REAL_DATA_DIRECTORY,      # Directory containing the real data CSVs
+                cacheDirectory : str = None,                    # Directory to store the fitted models in. Defaults to "Model Cache" in dataDirectory
+                useCache : bool = True,                         # Whether to load the fitted models from (and save them to) the cache
+                metrics : Metrics = None,                       # Records the stage times and prediction call counts. None records nothing
+                cacheKey : str = None):                         # Load the models saved under this key (e.g. by update) instead of the real data's models
+        # Random number generator used by the vectorised (batch) prediction functions.
+        self.rng = np.random.default_rng(seed)
+        self.dataDirectory = dataDirectory
+        self.cacheDirectory = os.path.join(dataDirectory, 'Model Cache') if cacheDirectory is None else cacheDirectory
+        self.metrics = NULL_METRICS if metrics is None else metrics
+        self.useCache = useCache
+
+        # Models saved after an update can't be rebuilt from the real data, so they have to be in the cache.
+        if cacheKey is not None:
+            self.cacheKey = cacheKey
+            with self.metrics.stage('Load model cache'):
+                if not self.loadFromCache():
+                    raise FileNotFoundError("No models saved with the key " + cacheKey + " in " + self.cacheDirectory)
+            return
+
+        # The cache is keyed by a hash of the training data and the fit settings, so it rebuilds itself when either changes.
+        with self.metrics.stage('Hash real data'):
+            self.cacheKey = self.calculateCacheKey()
+        if useCache:
+            with self.metrics.stage('Load model cache'):
+                loaded = self.loadFromCache()
+            if loaded:
+                return
+
         # Read in the training data
-        self.qtrData = self.setUpQuarterHourly()
-        self.dailyData = self.setUpDaily()
+        with self.metrics.stage('Load real data'):
+            self.qtrData = self.setUpQuarterHourly()
+            self.dailyData = self.setUpDaily()
 
         # Generate the models
-        self.quarterHourlyFlowAgainstLevel(plotGraph=False, displayStats=False)
-        self.dailyLevelAgainstWaterDifference(plotGraph=False, displayStats=False)
+        with self.metrics.stage('Fit models'):
+            self.quarterHourlyFlowAgainstLevel(plotGraph=False, displayStats=False)
+            self.dailyLevelAgainstWaterDifference(plotGraph=False, displayStats=False)
+
+        if useCache:
+            self.saveToCache()
+
+    def calculateCacheKey(self):
+        # Hash the contents of the training data files together with the fit settings.
+        sha = hashlib.sha256(json.dumps(FIT_SETTINGS, sort_keys=True).encode())
+        paths = [os.path.join(self.dataDirectory, name) for name in list(QUARTER_HOURLY_FILES.values()) + list(DAILY_FILES.values())]
+        return hashFiles(paths, sha).hexdigest()[:16]
+
+    def cacheFilePath(self):
+        return os.path.join(self.cacheDirectory, 'predictors-' + self.cacheKey + '.json')
+
+    def loadFromCache(self):
+        # Load the fitted state from the cache. Returns False if there is no cache for the current data and settings.
+        try:
+            with open(self.cacheFilePath(), 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        self.flowCoefficients = np.array(state['flowCoefficients'])
+        self.highFlowOffset = state['highFlowOffset']
+        self.levelCoefficients = np.array(state['levelCoefficients'])
+        self.std = state['std']
+        self.flowStatistics = {name: np.array(value) for name, value in state['flowStatistics'].items()}
+        self.levelStatistics = {name: np.array(value) for name, value in state['levelStatistics'].items()}
+        self.lastDailyRow = state['lastDailyRow']
+
+        # The sklearn models aren't cached, only the coefficients taken from them.
+        self.lr1 = None
+        self.lr2 = None
+        return True
+
+    def saveToCache(self):
+        # Save the fitted state to the cache. Written to a temporary file first so a half-written cache is never read.
+        state = {'flowCoefficients': self.flowCoefficients.tolist(),
+                 'highFlowOffset': float(self.highFlowOffset),
+                 'levelCoefficients': self.levelCoefficients.tolist(),
+                 'std': self.std,
+                 'flowStatistics': {name: np.asarray(value).tolist() for name, value in self.flowStatistics.items()},
+                 'levelStatistics': {name: np.asarray(value).tolist() for name, value in self.levelStatistics.items()},
+                 'lastDailyRow': self.lastDailyRow}
+        os.makedirs(self.cacheDirectory, exist_ok=True)
+        temporaryPath = self.cacheFilePath() + '.' + str(os.getpid()) + '.tmp'
+        with open(temporaryPath, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporaryPath, self.cacheFilePath())
+
+    def __getstate__(self):
+        # When a Predictors is pickled (e.g. sent to worker processes) only send the fitted models, not the training data.
+        state = self.__dict__.copy()
+        state.pop('qtrData', None)
+        state.pop('dailyData', None)
+        return state
 
     def setUpQuarterHourly(self):
-        # Import the data
-        flow = pd.read_csv('/home/iain/Desktop/IEL/Data/Real Data/Quater_Hourly_Readings/Quarter Hourly Flow Rate.csv', delimiter=';')
-        flow.rename(columns={'Value': 'Flow Rate'}, inplace=True)
-        rain = pd.read_csv('/home/iain/Desktop/IEL/Data/Real Data/Quater_Hourly_Readings/Quarter Hourly Precipitation.csv', delimiter=';')
-        rain.rename(columns={'Value': 'Precipitation'}, inplace=True)
-        level = pd.read_csv('/home/iain/Desktop/IEL/Data/Real Data/Quater_Hourly_Readings/Quarter Hourly Level.csv', delimiter=';')
-        level.rename(columns={'Value': 'Water Level'}, inplace=True)
-
-        # Merge the data
-        merged = pd.merge(flow, rain, on='#Timestamp')
-        merged = pd.merge(merged, level, on='#Timestamp')
-        merged = merged.drop('Quality Code', axis=1)
-        merged = merged.drop('Quality Code_x', axis=1)
-        merged = merged.drop('Quality Code_y', axis=1)
-        merged.dropna(inplace=True)
-
-        return merged
+        # Import the data, aligned on the timestamps (loaded from the real data store in the cache directory if possible)
+        data = loadRealData(QUARTER_HOURLY_FILES, self.dataDirectory, self.cacheDirectory)
+        return self.trainingData(data, QUARTER_HOURLY_FILES)
 
     def setUpDaily(self):
-        # Import the new data and create a dataframe
-        daily_flow = pd.read_csv('/home/iain/Desktop/IEL/Data/Real Data/Daily Aggregates/Daily Mean Flow Rate.csv', delimiter=';')
-        daily_flow.rename(columns={'Value': 'Flow Rate'}, inplace=True)
-        daily_rain = pd.read_csv('/home/iain/Desktop/IEL/Data/Real Data/Daily Aggregates/Daily Precipitation.csv', delimiter=';')
-        daily_rain.rename(columns={'Value': 'Precipitation'}, inplace=True)
-        daily_level = pd.read_csv('/home/iain/Desktop/IEL/Data/Real Data/Daily Aggregates/Daily Mean Level.csv', delimiter=';')
-        daily_level.rename(columns={'Value': 'Water Level'}, inplace=True)
-
-        # Merge the 3 datasets into one
-        merged = pd.merge(daily_flow, daily_rain, on=['#Timestamp'])
-        merged = pd.merge(merged, daily_level, on=['#Timestamp'])
-        merged = merged.drop('Quality Code_x', axis=1)
-        merged = merged.drop('Quality Code_y', axis=1)
-        merged = merged.drop('Quality Code', axis=1)
-        merged.dropna(inplace=True)
-        
+        # Import the data, aligned on the timestamps (loaded from the real data store in the cache directory if possible)
+        data = loadRealData(DAILY_FILES, self.dataDirectory, self.cacheDirectory)
+        merged = self.trainingData(data, DAILY_FILES).astype(np.float64)
+
         return calculateWaterAndLevelDifference(dataframe = merged, daily = True)
 
+    def trainingData(self, data, files : dict):
+        # Select the rows to train on (filtered by quality code if FIT_SETTINGS asks for it) and drop rows with missing values.
+        # The values stay float32, so range checks such as "> 0.2" compare against the float32 value of 0.2 and give the
+        # same rows as before; they are converted to double precision where the models are fitted.
+        if FIT_SETTINGS['qualityCodes'] is not None:
+            data = data[qualityMask(data, FIT_SETTINGS['qualityCodes'])]
+        merged = data[list(files)]
+        merged = merged.dropna()
+        return merged
+
     def quarterHourlyFlowAgainstLevel(self, plotGraph = False, displayStats = False):
         # Use sklearn to fit a 3 degree polynomial curve to the water flow against water level data.
+        from sklearn.preprocessing import PolynomialFeatures
+        from sklearn.linear_model import LinearRegression
+        from sklearn.metrics import mean_squared_error, r2_score
+        from sklearn.model_selection import train_test_split
 
         # Only use water levels between 0.2 and 2
-        normalRange = self.qtrData[(self.qtrData['Water Level'] > 0.2) & (self.qtrData['Water Level'] < 2)]
-        X = normalRange['Water Level'].values.reshape(-1, 1)
-        y = normalRange['Flow Rate'].values.reshape(-1, 1)
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=0)
-        quadratic = PolynomialFeatures(degree=3)
+        minLevel, maxLevel = FIT_SETTINGS['flowLevelRange']
+        normalRange = self.qtrData[(self.qtrData['Water Level'] > minLevel) & (self.qtrData['Water Level'] < maxLevel)]
+        X = normalRange['Water Level'].values.astype(np.float64).reshape(-1, 1)
+        y = normalRange['Flow Rate'].values.astype(np.float64).reshape(-1, 1)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=FIT_SETTINGS['testSize'], random_state=FIT_SETTINGS['randomState'])
+        quadratic = PolynomialFeatures(degree=FIT_SETTINGS['flowDegree'])
         X_quad = quadratic.fit_transform(X)
         X_quad_test = quadratic.fit_transform(X_test)
         lr = LinearRegression()
@@ -111,6 +299,7 @@ class Predictors:
 
         # Plot the polynomial curve
         if plotGraph:
+            import matplotlib.pyplot as plt
 
             # Plot the data points
             X = self.qtrData['Water Level'].values.reshape(-1, 1)
@@ -141,10 +330,20 @@ class Predictors:
 
         self.lr1 = lr
 
+        # Take the cubic coefficients out of the model once, so the batch functions don't need to call sklearn.
+        # flowCoefficients[i] is the coefficient of level^i.
+        self.flowCoefficients = lr.coef_[0].astype(float)
+        self.flowCoefficients[0] += lr.intercept_[0]
+
+        # Above 2m the flow rate is a line of gradient 30 which meets the cubic at 2m.
+        self.highFlowOffset = 60 - np.polynomial.polynomial.polyval(2.0, self.flowCoefficients)
+
+        # Keep the sufficient statistics of the fit so it can be updated with new data (see update).
+        self.flowStatistics = leastSquaresStatistics(X, y, FIT_SETTINGS['flowDegree'])
+
     def generateQuarterHourlyFlow(self, level):
         # Given a level, use the polynomial curve to predict the flow rate.
-
-        quadratic = PolynomialFeatures(degree=3)
+        self.metrics.count('generateQuarterHourlyFlow')
 
         if (level <= 0.2):
             # If the level is below 0.2m, then the ML model doesn't work. So just set flow to zero with tiny noise.
@@ -155,25 +354,56 @@ class Predictors:
 
         if (level >= 2):
             # If the level is above 2m, the flow rate is directly proportional to the level with tiny noise
-            offset = 60 - self.lr1.predict(quadratic.fit_transform(np.array(2).reshape(-1, 1)))[0][0]
-            return level*30 - offset
-        
-        level = np.array(level).reshape(-1, 1)
-        temp = self.lr1.predict(quadratic.fit_transform(level))[0][0]
-        return temp
+            return level*30 - self.highFlowOffset
+
+        return float(np.polynomial.polynomial.polyval(level, self.flowCoefficients))
+
+    def generateQuarterHourlyFlowBatch(self, levels):
+        # Vectorised version of generateQuarterHourlyFlow. Given an array of levels, predict the flow rate for each of them in one pass.
+        levels = np.asarray(levels, dtype=float)
+        self.metrics.count('generateQuarterHourlyFlowBatch')
+        self.metrics.count('generateQuarterHourlyFlowBatch samples', levels.size)
+        flow = self.expectedQuarterHourlyFlow(levels)
+
+        # Below 0.2m the ML model doesn't work, so set the flow to zero with tiny (non-negative) noise.
+        # The absolute value of a gaussian has the same distribution as the rejection loop in generateQuarterHourlyFlow.
+        low = levels <= 0.2
+        flow[low] = np.abs(self.rng.normal(0, 0.01, np.count_nonzero(low)))
+
+        return flow
+
+    def expectedQuarterHourlyFlow(self, levels):
+        # Given an array of levels, return the flow rate on the flow curve without any noise (0 below 0.2m).
+        levels = np.asarray(levels, dtype=float)
+
+        # Normal water levels use the cubic curve.
+        flow = np.atleast_1d(np.polynomial.polynomial.polyval(levels, self.flowCoefficients)).reshape(levels.shape)
+
+        # Above 2m the flow rate is directly proportional to the level.
+        high = levels >= 2
+        flow[high] = levels[high]*30 - self.highFlowOffset
+        flow[levels <= 0.2] = 0.0
+
+        return flow
 
     def dailyLevelAgainstWaterDifference(self, plotGraph = False, displayStats = False):
         # Use sklearn to calculate the line of best fit for the water difference against the change in water level.
 
+        from sklearn.preprocessing import PolynomialFeatures
+        from sklearn.linear_model import LinearRegression
+        from sklearn.metrics import mean_squared_error, r2_score
+        from sklearn.model_selection import train_test_split
+
         # Remove days with water difference > 2000000 and > 2000000
-        typical = self.dailyData[self.dailyData['Water Difference'] < 2000000]
-        typical = typical[typical['Water Difference'] > -2000000]
+        maxWaterDifference = FIT_SETTINGS['maxWaterDifference']
+        typical = self.dailyData[self.dailyData['Water Difference'] < maxWaterDifference]
+        typical = typical[typical['Water Difference'] > -maxWaterDifference]
 
         # Fit a polynomial curve of Water difference (independent) and level derivative (dependent)
         X = typical['Water Difference'].values.reshape(-1, 1)
         y = typical['Level Difference'].values.reshape(-1, 1)
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=0)
-        quadratic = PolynomialFeatures(degree=1)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=FIT_SETTINGS['testSize'], random_state=FIT_SETTINGS['randomState'])
+        quadratic = PolynomialFeatures(degree=FIT_SETTINGS['levelDegree'])
         X_quad = quadratic.fit_transform(X)
         X_quad_test = quadratic.fit_transform(X_test)
         lr = LinearRegression()
@@ -191,6 +421,8 @@ class Predictors:
                 r2_score(y_test, y_quad_pred)))
 
         if plotGraph:
+            import matplotlib.pyplot as plt
+
             # Plot the polynomial curve
             plt.scatter(X, y, label='data points', color='lightgray', marker='.')
 
@@ -208,14 +440,79 @@ class Predictors:
             plt.show()
 
         # Calculate the standard deviation to be used for the gaussian distribution
-        numerator = sum((y_quad_pred - y_test) * (y_quad_pred - y_test))
+        numerator = np.sum((y_quad_pred - y_test) * (y_quad_pred - y_test))
         denominator = len(y_quad_pred) - 1
         self.std = math.sqrt(numerator / denominator)
         self.lr2 = lr
-        
+
+        # Take the line coefficients out of the model once. levelCoefficients[i] is the coefficient of waterDifference^i.
+        self.levelCoefficients = lr.coef_[0].astype(float)
+        self.levelCoefficients[0] += lr.intercept_[0]
+
+        # Keep the sufficient statistics of the fit so it can be updated with new data (see update).
+        # The last day has no next day, so its level difference is 0 until update is given the following days.
+        self.levelStatistics = leastSquaresStatistics(X, y, FIT_SETTINGS['levelDegree'], scale=maxWaterDifference)
+        last = self.dailyData.iloc[-1]
+        self.lastDailyRow = {'Water Difference': float(last['Water Difference']), 'Water Level': float(last['Water Level']),
+                             'Included': bool(abs(last['Water Difference']) < maxWaterDifference)}
+
+    def update(self, quarterHourlyRows = None, dailyRows = None):
+        # Update the models with new readings, in time proportional to the new data rather than the whole history.
+        # Both models are ordinary least squares fits, so adding the new rows' sufficient statistics to the stored ones
+        # gives the same coefficients as refitting on all of the data.
+        # quarterHourlyRows : Dataframe of new quarter-hourly readings with 'Water Level' and 'Flow Rate' columns.
+        # dailyRows : Dataframe of the days following the training data (in order) with 'Precipitation', 'Flow Rate' and 'Water Level' columns.
+        # After an update std is the residual standard deviation of the fit over all of the data, and lr1 and lr2
+        # (which no longer match the coefficients) are set to None.
+        if quarterHourlyRows is not None:
+            minLevel, maxLevel = FIT_SETTINGS['flowLevelRange']
+            rows = quarterHourlyRows[['Water Level', 'Flow Rate']].dropna()
+            rows = rows[(rows['Water Level'] > minLevel) & (rows['Water Level'] < maxLevel)]
+            self.flowStatistics = combineStatistics(self.flowStatistics, leastSquaresStatistics(rows['Water Level'], rows['Flow Rate'], FIT_SETTINGS['flowDegree']))
+            self.flowCoefficients, _ = solveLeastSquares(self.flowStatistics)
+            self.highFlowOffset = 60 - np.polynomial.polynomial.polyval(2.0, self.flowCoefficients)
+            self.lr1 = None
+
+        if dailyRows is not None and len(dailyRows) > 0:
+            maxWaterDifference = FIT_SETTINGS['maxWaterDifference']
+            rows = calculateWaterAndLevelDifference(dataframe = dailyRows[['Precipitation', 'Flow Rate', 'Water Level']].dropna().astype(np.float64), daily = True)
+
+            # The previous last day was counted with a level difference of 0. Now the next day is known, count it properly.
+            previous = self.lastDailyRow
+            if previous['Included']:
+                self.levelStatistics = combineStatistics(self.levelStatistics, leastSquaresStatistics([previous['Water Difference']], [0.0], FIT_SETTINGS['levelDegree'], maxWaterDifference), sign=-1)
+            waterDifference = np.concatenate([[previous['Water Difference']], rows['Water Difference'].values])
+            levelDifference = np.concatenate([[rows['Water Level'].values[0] - previous['Water Level']], rows['Level Difference'].values])
+
+            typical = (waterDifference < maxWaterDifference) & (waterDifference > -maxWaterDifference)
+            typical[0] = previous['Included']
+            self.levelStatistics = combineStatistics(self.levelStatistics, leastSquaresStatistics(waterDifference[typical], levelDifference[typical], FIT_SETTINGS['levelDegree'], maxWaterDifference))
+
+            self.levelCoefficients, residualSumOfSquares = solveLeastSquares(self.levelStatistics)
+            self.std = math.sqrt(residualSumOfSquares / (self.levelStatistics['n'] - 1))
+            self.lastDailyRow = {'Water Difference': float(waterDifference[-1]), 'Water Level': float(rows['Water Level'].values[-1]),
+                                 'Included': bool(typical[-1])}
+            self.lr2 = None
+
+        # The models no longer match the training data files, so give them a new key made from the old key and the
+        # updated statistics. Anything keyed by the models (e.g. a generation checkpoint) then sees that they have changed.
+        # The updated models are saved to the cache under the new key, so a later run can load them with Predictors(cacheKey=...).
+        if quarterHourlyRows is not None or (dailyRows is not None and len(dailyRows) > 0):
+            sha = hashlib.sha256(self.cacheKey.encode())
+            for statistics in (self.flowStatistics, self.levelStatistics):
+                for name in sorted(statistics):
+                    sha.update(np.asarray(statistics[name], dtype=np.float64).tobytes())
+            self.cacheKey = sha.hexdigest()[:16]
+            if self.useCache:
+                self.saveToCache()
+
+    def expectedLevelDerivative(self, waterDifference):
+        # Given a water difference (or an array of them), return the change in water level predicted by the line of best fit, without noise.
+        self.metrics.count('expectedLevelDerivative')
+        return np.polynomial.polynomial.polyval(np.asarray(waterDifference, dtype=float), self.levelCoefficients)
+
     def generateLevelDerivativeFromWaterDifference(self, waterDifference):
         # Given a water difference, use the ML model to estimate the change ini water level. Uses gaussian distribution for noise.
-        quadratic = PolynomialFeatures(degree=1)
-        waterDifference = np.array(waterDifference).reshape(-1, 1)
-        temp = self.lr2.predict(quadratic.fit_transform(waterDifference))[0][0]
+        self.metrics.count('generateLevelDerivativeFromWaterDifference')
+        temp = float(self.expectedLevelDerivative(waterDifference))
         return random.gauss(temp, self.std)
\ No newline at end of file
@@ -0,0 +1,330 @@
+import os
+import json
+import math
+import time
+import threading
+import datetime
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from DataGeneratorPredictors import REAL_DATA_DIRECTORY
+
+# Address of the SEPA KiWIS API. See "Data/Real Data/README.md" for how the API is used.
+SEPA_URL = 'https://timeseries.sepa.org.uk/KiWIS/KiWIS'
+
+# Default directory for the cached station ids and downloaded values.
+SEPA_CACHE_DIRECTORY = os.path.join(REAL_DATA_DIRECTORY, 'SEPA Cache')
+
+class SEPAError(IOError):
+    # Raised when the SEPA API returns an error or an unexpected response.
+    pass
+
+class SEPAClient:
+    # Client for the SEPA KiWIS API.
+    # One connection is kept open and reused for every request. Station to ts_id lookups and downloaded values are cached
+    # on disk, and values are requested in chunks of days so only the days which aren't in the cache are downloaded.
+    # A download which is interrupted part way through resumes from the first missing chunk.
+    # A client (and its connection) must only be used by one thread at a time, but clients in different threads can share a cache.
+
+    # Guards the station to ts_id cache, which is shared by every station.
+    cacheLock = threading.Lock()
+
+    def __init__(self,
+                baseUrl : str = SEPA_URL,                         # Address of the KiWIS API (e.g. a LocalKiWISServer url for testing)
+                cacheDirectory : str = SEPA_CACHE_DIRECTORY,      # Directory to cache ts_ids and values in. None disables the cache
+                chunkDays : int = 30,                             # Maximum number of days to request at once
+                timeout : float = 30,                             # Timeout of each request (s)
+                publicationDelay : int = 3):                      # Days SEPA may take to publish every value. Younger days are only cached once complete
+        self.url = urllib.parse.urlsplit(baseUrl)
+        self.cacheDirectory = cacheDirectory
+        self.chunkDays = chunkDays
+        self.timeout = timeout
+        self.publicationDelay = publicationDelay
+        self.connection = None
+
+    def connect(self):
+        if self.url.scheme == 'https':
+            return http.client.HTTPSConnection(self.url.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.url.netloc, timeout=self.timeout)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, parameters : dict):
+        # Make a KiWIS request over the shared connection and return the parsed JSON response.
+        query = {'service': 'kisters', 'type': 'queryServices', 'datasource': 0, 'format': 'json'}
+        query.update(parameters)
+        path = self.url.path + '?' + urllib.parse.urlencode(query, quote_via=urllib.parse.quote)
+
+        # If the server has closed the kept-alive connection, reconnect and try once more.
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = self.connect()
+            try:
+                self.connection.request('GET', path)
+                response = self.connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionResetError, BrokenPipeError) as e:
+                self.close()
+                if attempt == 1:
+                    raise SEPAError('Lost the connection to the SEPA API: ' + repr(e)) from e
+            except http.client.HTTPException as e:
+                # e.g. IncompleteRead or BadStatusLine. These aren't OSErrors, so callers falling back on OSError wouldn't catch them.
+                self.close()
+                raise SEPAError('Bad response from the SEPA API: ' + repr(e)) from e
+
+        if response.status != 200:
+            raise SEPAError('SEPA API returned HTTP ' + str(response.status) + ' for ' + parameters.get('request', ''))
+        return json.loads(body)
+
+    def cachePath(self, *names):
+        path = os.path.join(self.cacheDirectory, *names)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def readCache(self, *names):
+        if self.cacheDirectory is None:
+            return {}
+        try:
+            with open(os.path.join(self.cacheDirectory, *names), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def writeCache(self, data, *names):
+        # Written to a temporary file first so a half-written cache file is never read.
+        if self.cacheDirectory is None:
+            return
+        path = self.cachePath(*names)
+        temporaryPath = path + '.' + str(threading.get_ident()) + '.tmp'
+        with open(temporaryPath, 'w') as f:
+            json.dump(data, f)
+        os.replace(temporaryPath, path)
+
+    def getTimeseriesId(self, stationName : str = "Dippen", timeseriesName : str = "15minute.Total", parameter : str = "Precip"):
+        # Get the ts_id of a station's timeseries. This is required to get the data.
+        key = stationName + '|' + timeseriesName + '|' + parameter
+        with self.cacheLock:
+            ids = self.readCache('timeseries ids.json')
+        if key in ids:
+            return ids[key]
+
+        data_json = self.request({'request': 'getTimeseriesList', 'station_name': stationName})
+        for entry in data_json:
+            if entry[4] == timeseriesName and entry[6] == parameter:
+                # Read the cache again, in case another thread has added a station since.
+                with self.cacheLock:
+                    ids = self.readCache('timeseries ids.json')
+                    ids[key] = entry[3]
+                    self.writeCache(ids, 'timeseries ids.json')
+                return entry[3]
+
+        raise SEPAError('No ' + timeseriesName + ' ' + parameter + ' timeseries found for station ' + stationName)
+
+    def getValues(self, timeseriesId, firstDay : datetime.date, lastDay : datetime.date, samplesPerDay : int = 96):
+        # Get the (timestamp, value) rows of a timeseries for every day from firstDay to lastDay (inclusive).
+        # Days are cached by month once they are complete: when they have samplesPerDay rows, or (as some values are never
+        # published) once they are older than publicationDelay days. Other days are downloaded again every time.
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        published = today - datetime.timedelta(days=self.publicationDelay)
+        days = [firstDay + datetime.timedelta(days=i) for i in range((lastDay - firstDay).days + 1)]
+
+        months = {}
+        for day in days:
+            month = day.strftime('%Y-%m')
+            if month not in months:
+                months[month] = self.readCache(str(timeseriesId), month + '.json')
+
+        # Download the missing days in chunks of consecutive days.
+        missing = [day for day in days if day >= today or day.isoformat() not in months[day.strftime('%Y-%m')]]
+        incomplete = {}
+        for chunk in self.chunks(missing):
+            data_json = self.request({'request': 'getTimeseriesValues', 'ts_id': timeseriesId,
+                                      'from': chunk[0].isoformat(), 'to': chunk[-1].isoformat() + 'T23:59:59',
+                                      'returnfields': 'Timestamp,Value,Quality Code'})
+            rows = {day.isoformat(): [] for day in chunk}
+            for row in data_json[0]['data']:
+                if row[0][:10] in rows:
+                    rows[row[0][:10]].append(row[:2])
+
+            # Save each chunk as soon as it arrives, so an interrupted download doesn't have to start again.
+            changedMonths = set()
+            for day in chunk:
+                month = day.strftime('%Y-%m')
+                if day < today and (len(rows[day.isoformat()]) >= samplesPerDay or day < published):
+                    months[month][day.isoformat()] = rows[day.isoformat()]
+                    changedMonths.add(month)
+                else:
+                    # Keep the values of incomplete days for this call only.
+                    incomplete[day.isoformat()] = rows[day.isoformat()]
+            for month in changedMonths:
+                self.writeCache(months[month], str(timeseriesId), month + '.json')
+
+        return [row for day in days
+                for row in (incomplete[day.isoformat()] if day.isoformat() in incomplete else months[day.strftime('%Y-%m')][day.isoformat()])]
+
+    def chunks(self, days : list()):
+        # Split a sorted list of days into runs of consecutive days no longer than chunkDays.
+        chunk = []
+        for day in days:
+            if len(chunk) > 0 and ((day - chunk[-1]).days != 1 or len(chunk) >= self.chunkDays):
+                yield chunk
+                chunk = []
+            chunk.append(day)
+        if len(chunk) > 0:
+            yield chunk
+
+    def readRainfall(self, stationName : str = "Dippen", samples : int = 100):
+        # Read the quarter-hourly rainfall of the last ceil(samples / 96) days (the same period as "P<days>D").
+        # Returns the first `samples` values and the number of values returned.
+        rainfallData = [row[1] for row in self.readRainfallRows(stationName, samples)]
+        return rainfallData, len(rainfallData)
+
+    def readRainfallRows(self, stationName : str = "Dippen", samples : int = 100):
+        # The same as readRainfall, but returns the first `samples` (timestamp, value) rows.
+        numberOfDays = math.ceil(samples / 96)
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+
+        timeseriesId = self.getTimeseriesId(stationName)
+        rows = self.getValues(timeseriesId, today - datetime.timedelta(days=numberOfDays), today)
+        return rows[0:samples]
+
+def fetchRainfall(stationNames : list(), samples : int = 100, concurrency : int = 4, baseUrl : str = SEPA_URL,
+                  cacheDirectory : str = SEPA_CACHE_DIRECTORY, chunkDays : int = 30, timeout : float = 30):
+    # Download the rainfall of several stations at once, with at most `concurrency` stations being downloaded at a time.
+    # Each thread has its own SEPAClient (and so its own connection), as a connection can't be shared between threads.
+    # Yields (station name, rainfall, error) as soon as each station has finished, in the order they finish.
+    # rainfall is the list of the first `samples` values (see SEPAClient.readRainfall) and error is None,
+    # or if the station couldn't be downloaded, rainfall is None and error is the exception.
+    local = threading.local()
+    clients = []
+    lock = threading.Lock()
+
+    def fetch(stationName):
+        if not hasattr(local, 'client'):
+            local.client = SEPAClient(baseUrl, cacheDirectory, chunkDays, timeout)
+            with lock:
+                clients.append(local.client)
+        return local.client.readRainfall(stationName, samples)[0]
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(fetch, stationName): stationName for stationName in stationNames}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except (OSError, ValueError, KeyError, IndexError) as e:
+                    yield futures[future], None, e
+    finally:
+        for client in clients:
+            client.close()
+
+class LocalKiWISServer:
+    # A local stand-in for the SEPA KiWIS API, so the client can be used and tested offline.
+    # Serves getTimeseriesList and getTimeseriesValues (with from/to or period) in the same JSON layout as SEPA,
+    # using synthetic quarter-hourly rainfall. Use as a context manager and pass .url to SEPAClient.
+
+    def __init__(self, stations : dict = None, rainfall = None, delay : float = 0):
+        # stations : Dictionary of station name to the ts_id of its 15minute.Total Precip timeseries.
+        # rainfall : Function of a datetime returning the rainfall (mm) for the quarter hour starting then.
+        #            Returning None leaves the quarter hour out, as SEPA does for values which haven't been published.
+        # delay : Seconds to wait before each response, to stand in for the round-trip time to SEPA.
+        self.stations = {'Dippen': 1000} if stations is None else stations
+        self.delay = delay
+        self.rainfall = rainfall if rainfall is not None else lambda t: round(((t.toordinal() * 96 + t.hour * 4 + t.minute // 15) * 7919 % 97) / 97 * 2, 1) if t.day % 3 == 0 else 0.0
+
+        # Number of requests received of each type, to check what the client has cached,
+        # and the most requests which have been in progress at once, to check how many connections the client uses.
+        self.requestCounts = {}
+        self.activeRequests = 0
+        self.peakActiveRequests = 0
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.url = 'http://127.0.0.1:' + str(self.server.server_address[1]) + '/KiWIS/KiWIS'
+        self.thread = None
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+                with stand_in.lock:
+                    stand_in.requestCounts[query.get('request')] = stand_in.requestCounts.get(query.get('request'), 0) + 1
+                    stand_in.activeRequests += 1
+                    stand_in.peakActiveRequests = max(stand_in.peakActiveRequests, stand_in.activeRequests)
+                try:
+                    time.sleep(stand_in.delay)
+                    status, data = stand_in.respond(query)
+                    body = json.dumps(data).encode()
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with stand_in.lock:
+                        stand_in.activeRequests -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def respond(self, query : dict):
+        if query.get('request') == 'getTimeseriesList':
+            rows = [['station_name', 'station_no', 'station_id', 'ts_id', 'ts_name', 'parametertype_id', 'parametertype_name']]
+            if query.get('station_name') in self.stations:
+                station = query['station_name']
+                tsId = self.stations[station]
+                rows.append([station, '1', '1', str(tsId + 1), 'Day.Total', '1', 'Precip'])
+                rows.append([station, '1', '1', str(tsId), '15minute.Total', '1', 'Precip'])
+            return 200, rows
+
+        if query.get('request') == 'getTimeseriesValues':
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            if 'period' in query:
+                end = now
+                start = (now - datetime.timedelta(days=int(query['period'][1:-1]))).replace(hour=0, minute=0, second=0, microsecond=0)
+            else:
+                start = datetime.datetime.fromisoformat(query['from'])
+                end = min(datetime.datetime.fromisoformat(query['to']), now)
+
+            data = []
+            t = start
+            while t <= end:
+                value = self.rainfall(t)
+                if value is not None:
+                    data.append([t.strftime('%Y-%m-%dT%H:%M:%S.000Z'), value, 50])
+                t += datetime.timedelta(minutes=15)
+            return 200, [{'ts_id': query.get('ts_id'), 'rows': str(len(data)), 'columns': 'Timestamp,Value,Quality Code', 'data': data}]
+
+        return 400, {'type': 'error', 'message': 'Unsupported request'}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,114 @@
+import os
+import copy
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from DataGenerator import DataGenerator
+from DataGeneratorPredictors import Predictors
+from DataGeneratorSEPA import fetchRainfall, SEPA_URL, SEPA_CACHE_DIRECTORY
+
+# The fitted predictors and shared rainfall of the current worker process. Set once per worker by initialiseWorker.
+workerPredictors = None
+workerRainfall = None
+
+def initialiseWorker(predictors : Predictors, rainfall : list() = None):
+    # Called once when each worker process starts, so the fitted models (and shared rainfall) are only sent once per worker.
+    global workerPredictors, workerRainfall
+    workerPredictors = predictors
+    workerRainfall = rainfall
+
+def runScenario(name, scenario : dict, seedSequence : np.random.SeedSequence, tolerance : float = None, maxPasses : int = 35):
+    # Run one scenario in the current worker and return its quarter-hourly results as a dataframe.
+    # scenario : Keyword arguments for DataGenerator (e.g. startingWaterLevel, catchementArea, volumeOfWaterComingFromDamn, rainfall).
+    #            If 'rainfall' isn't given, 'rainfallWindow' = (first sample, last sample) selects a window of the shared rainfall.
+    scenario = dict(scenario)
+    window = scenario.pop('rainfallWindow', None)
+    if 'rainfall' not in scenario:
+        start, end = window if window is not None else (0, len(workerRainfall))
+        scenario['rainfall'] = workerRainfall[start:end]
+    scenario.setdefault('numOfSamples', len(scenario['rainfall']))
+
+    # Each scenario gets its own random number substream, so results don't depend on which worker ran it.
+    workerPredictors.rng = np.random.default_rng(seedSequence)
+
+    dg = DataGenerator(predictors=workerPredictors, **scenario)
+    flowRates, levels, passesPerDay, concentrations = dg.simulate(tolerance=tolerance, maxPasses=maxPasses)
+
+    results = pd.DataFrame({'Precipitation': np.asarray(dg.rainfall[:len(levels)], dtype=float),
+                            'Flow Rate': flowRates,
+                            'Water Level': levels})
+    for column, values in concentrations.items():
+        results[column] = values
+    return name, results
+
+def runScenarios(scenarios : dict, predictors : Predictors, rainfall : list() = None, seed : int = 0, workers : int = None,
+                 tolerance : float = None, maxPasses : int = 35):
+    # Run many independent scenarios across a pool of worker processes.
+    # scenarios : Dictionary of scenario name to DataGenerator keyword arguments (see runScenario).
+    # predictors : Fitted predictors, sent to each worker once rather than retrained per scenario.
+    # rainfall : Optional rainfall shared by every scenario which doesn't provide its own.
+    # seed : Seed for the random number substreams. The same seed gives the same results whatever the number of workers.
+    # workers : Number of worker processes. Defaults to the number of CPUs, 1 runs everything in this process.
+    # Returns a single dataframe indexed by (Scenario, Sample).
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    names = list(scenarios)
+    seedSequences = np.random.SeedSequence(seed).spawn(len(names))
+
+    if workers == 1:
+        # Use a copy so the caller's random number generator isn't replaced.
+        initialiseWorker(copy.copy(predictors), rainfall)
+        results = dict(runScenario(name, scenarios[name], seedSequence, tolerance, maxPasses) for name, seedSequence in zip(names, seedSequences))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=initialiseWorker, initargs=(predictors, rainfall)) as executor:
+            futures = [executor.submit(runScenario, name, scenarios[name], seedSequence, tolerance, maxPasses)
+                       for name, seedSequence in zip(names, seedSequences)]
+            results = dict(future.result() for future in futures)
+
+    # Keep the results in the order the scenarios were given.
+    return pd.concat([results[name] for name in names], keys=names, names=['Scenario', 'Sample'])
+
+def runStations(stations : dict, predictors : Predictors, samples : int = 96, seed : int = 0, workers : int = None, concurrency : int = 4,
+                baseUrl : str = SEPA_URL, cacheDirectory : str = SEPA_CACHE_DIRECTORY, tolerance : float = None, maxPasses : int = 35):
+    # Download the rainfall of several SEPA stations concurrently and generate data for each station as soon as its rainfall arrives,
+    # rather than waiting for every download to finish.
+    # stations : Dictionary of station name to its catchment area (km2), or to DataGenerator keyword arguments (see runScenario).
+    # samples : Number of quarter-hourly rainfall samples to download for each station.
+    # concurrency : Maximum number of stations downloaded at once.
+    # baseUrl, cacheDirectory : Passed to each SEPAClient (e.g. the url of a LocalKiWISServer for testing).
+    # The other arguments are the same as runScenarios. The random number substreams are assigned in the order the stations are
+    # given, so the results don't depend on the order the downloads finish in.
+    # Returns a dataframe indexed by (Scenario, Sample) of the stations which were generated, and a dictionary of station name
+    # to the exception for any station whose rainfall couldn't be downloaded.
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    names = list(stations)
+    seedSequences = dict(zip(names, np.random.SeedSequence(seed).spawn(len(names))))
+    scenarios = {name: dict(scenario) if isinstance(scenario, dict) else {'catchementArea': scenario} for name, scenario in stations.items()}
+    downloads = fetchRainfall(names, samples, concurrency, baseUrl, cacheDirectory)
+
+    results = {}
+    errors = {}
+    if workers == 1:
+        initialiseWorker(copy.copy(predictors), None)
+        for name, rainfall, error in downloads:
+            if error is not None:
+                errors[name] = error
+                continue
+            results[name] = runScenario(name, dict(scenarios[name], rainfall=rainfall), seedSequences[name], tolerance, maxPasses)[1]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=initialiseWorker, initargs=(predictors, None)) as executor:
+            futures = []
+            for name, rainfall, error in downloads:
+                if error is not None:
+                    errors[name] = error
+                    continue
+                futures.append(executor.submit(runScenario, name, dict(scenarios[name], rainfall=rainfall), seedSequences[name], tolerance, maxPasses))
+            results = dict(future.result() for future in futures)
+
+    generated = [name for name in names if name in results]
+    if len(generated) == 0:
+        return pd.DataFrame(), errors
+    return pd.concat([results[name] for name in generated], keys=generated, names=['Scenario', 'Sample']), errors
@@ -0,0 +1,190 @@
+import os
+import sys
+import stat
+import time
+import argparse
+import numpy as np
+from DataGeneratorPredictors import Predictors
+from DataGeneratorMetrics import Metrics, NULL_METRICS
+
+# Baud rate used by Water-Level-Sensor.ino.
+SENSOR_BAUD_RATE = 9600
+
+def parseReading(line):
+    # Parse one line sent by the sensor. Lines are either "<level>" or "<timestamp>,<level>" (timestamp in seconds).
+    # Returns (timestamp or None, level), or None for lines which aren't readings (e.g. blank lines or status messages).
+    if isinstance(line, bytes):
+        line = line.decode('ascii', errors='ignore')
+    fields = line.strip().split(',')
+    try:
+        if len(fields) == 1:
+            return None, float(fields[0])
+        if len(fields) == 2:
+            return float(fields[0]), float(fields[1])
+    except ValueError:
+        pass
+    return None
+
+class RingBuffer:
+    # Fixed size buffer of the most recent values. Appending never allocates, so memory and time per reading are bounded.
+
+    def __init__(self, size : int):
+        self.values = np.zeros(size)
+        self.size = size
+        self.index = 0
+        self.count = 0
+
+    def append(self, value : float):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def latest(self, n : int = None):
+        # The last n values (all of the buffered values if n is None), oldest first.
+        n = self.count if n is None else min(n, self.count)
+        return self.values[(self.index - n + np.arange(n)) % self.size]
+
+    def __len__(self):
+        return self.count
+
+class SensorMonitor:
+    # Turns a stream of water level readings into live flow estimates and short-horizon flood forecasts.
+    # The flow is read off the fitted flow curve (without noise), and the level is forecast by a straight line fitted to the
+    # last few readings. Each reading does a fixed amount of work, however long the monitor has been running.
+
+    def __init__(self,
+                predictors : Predictors,                    # The fitted models, for the flow curve
+                bufferSize : int = 1024,                    # Number of recent readings to keep
+                fitReadings : int = 20,                     # Number of recent readings the level trend is fitted to
+                horizon : float = 900,                      # How far ahead to forecast the level (s)
+                property_flooding_level : float = 1.0,      # The level at which property flooding occurs (m)
+                low_lying_land_flooding_level : float = 1.0,# The level at which low lying land flooding occurs (m)
+                levelScale : float = 0.01,                  # Multiplier converting the sensor's readings to metres (the sketch sends cm)
+                levelOffset : float = 0.0,                  # Added to the scaled reading, e.g. the river level when the sensor reads 0 (m)
+                metrics : Metrics = None):
+        self.predictors = predictors
+        self.fitReadings = fitReadings
+        self.horizon = horizon
+        self.property_flooding_level = property_flooding_level
+        self.low_lying_land_flooding_level = low_lying_land_flooding_level
+        self.levelScale = levelScale
+        self.levelOffset = levelOffset
+        self.metrics = NULL_METRICS if metrics is None else metrics
+
+        self.levels = RingBuffer(bufferSize)
+        self.times = RingBuffer(bufferSize)
+
+    def update(self, reading : float, timestamp : float = None):
+        # Add a reading and return a dictionary of the current level, flow rate, level trend, forecast level and flood warnings.
+        # timestamp : Time of the reading (s). Defaults to the time it arrived.
+        start = time.perf_counter()
+        timestamp = time.time() if timestamp is None else timestamp
+        level = reading * self.levelScale + self.levelOffset
+        self.levels.append(level)
+        self.times.append(timestamp)
+
+        # Least squares slope of the last few readings (m/s).
+        slope = 0.0
+        levels = self.levels.latest(self.fitReadings)
+        if len(levels) > 1:
+            times = self.times.latest(self.fitReadings)
+            times = times - times.mean()
+            spread = np.dot(times, times)
+            if spread > 0:
+                slope = float(np.dot(times, levels - levels.mean()) / spread)
+
+        forecast = min(max(level + slope * self.horizon, 0.1), 2.6)
+        result = {'Timestamp': timestamp,
+                  'Water Level': level,
+                  'Flow Rate': float(self.predictors.expectedQuarterHourlyFlow(level)),
+                  'Level Trend': slope,
+                  'Forecast Level': forecast,
+                  'Forecast Flow Rate': float(self.predictors.expectedQuarterHourlyFlow(forecast)),
+                  'Property Flooding': level >= self.property_flooding_level,
+                  'Property Flooding Forecast': forecast >= self.property_flooding_level,
+                  'Time To Property Flooding': self.timeToLevel(level, slope, self.property_flooding_level),
+                  'Low Lying Land Flooding': level >= self.low_lying_land_flooding_level,
+                  'Low Lying Land Flooding Forecast': forecast >= self.low_lying_land_flooding_level,
+                  'Time To Low Lying Land Flooding': self.timeToLevel(level, slope, self.low_lying_land_flooding_level)}
+        result['Latency'] = time.perf_counter() - start
+
+        self.metrics.count('Sensor readings')
+        return result
+
+    def timeToLevel(self, level : float, slope : float, threshold : float):
+        # Seconds until the level reaches the threshold at the current trend. 0 if it already has, None if it isn't rising towards it.
+        if level >= threshold:
+            return 0.0
+        if slope <= 0:
+            return None
+        return (threshold - level) / slope
+
+def openSensor(path : str, baudRate : int = SENSOR_BAUD_RATE):
+    # Open a serial device, pipe or file to read readings from. Serial devices (including ptys) are switched to raw mode at baudRate.
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOCTTY', 0))
+    if os.isatty(fd):
+        import termios
+        import tty
+        tty.setraw(fd)
+        attributes = termios.tcgetattr(fd)
+        speed = getattr(termios, 'B' + str(baudRate))
+        attributes[4] = speed
+        attributes[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    return os.fdopen(fd, 'rb', buffering=0)
+
+def readLines(stream, follow : bool = True, pollInterval : float = 0.05, stop = None):
+    # Yield each complete line from a stream as soon as it arrives.
+    # follow : For regular files, keep waiting for new lines at the end of the file (like tail -f) instead of stopping.
+    # stop : Optional function which returns True when reading should stop (checked whenever there is nothing to read).
+    # Serial devices and pipes block until data arrives; the stream ends when the writer closes it.
+    regularFile = stat.S_ISREG(os.fstat(stream.fileno()).st_mode)
+    partial = b''
+    while True:
+        try:
+            data = stream.readline() if regularFile else os.read(stream.fileno(), 4096)
+        except OSError:
+            # A pty raises EIO once the other end has closed.
+            data = b''
+
+        if data:
+            if isinstance(data, str):
+                data = data.encode()
+            lines = (partial + data).split(b'\n')
+            partial = lines.pop()
+            for line in lines:
+                yield line.rstrip(b'\r')
+            continue
+
+        if not regularFile or not follow or (stop is not None and stop()):
+            if partial:
+                yield partial
+            return
+        time.sleep(pollInterval)
+
+def monitorSensor(stream, monitor : SensorMonitor, follow : bool = True, pollInterval : float = 0.05, stop = None):
+    # Yield the result of SensorMonitor.update for each reading in a stream. Lines which aren't readings are skipped.
+    for line in readLines(stream, follow, pollInterval, stop):
+        reading = parseReading(line)
+        if reading is not None:
+            yield monitor.update(reading[1], reading[0])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Estimate the flow rate and forecast flooding from live Water-Level-Sensor readings.')
+    parser.add_argument('path', help='Serial device (e.g. /dev/ttyACM0), pipe or file the readings are written to. "-" reads stdin')
+    parser.add_argument('--horizon', type=float, default=900, help='How far ahead to forecast the level (s)')
+    parser.add_argument('--scale', type=float, default=0.01, help='Multiplier converting the readings to metres')
+    parser.add_argument('--offset', type=float, default=0.0, help='Added to the scaled readings (m)')
+    parser.add_argument('--flooding-level', type=float, default=1.0, help='The level at which flooding occurs (m)')
+    args = parser.parse_args()
+
+    monitor = SensorMonitor(Predictors(), horizon=args.horizon, levelScale=args.scale, levelOffset=args.offset,
+                            property_flooding_level=args.flooding_level, low_lying_land_flooding_level=args.flooding_level)
+    stream = sys.stdin.buffer if args.path == '-' else openSensor(args.path)
+    for result in monitorSensor(stream, monitor):
+        warning = ''
+        if result['Property Flooding']:
+            warning = ' FLOODING'
+        elif result['Property Flooding Forecast']:
+            warning = ' Flooding in %.0f s' % result['Time To Property Flooding']
+        print('Level %.3f m, flow %.3f m3/s, forecast %.3f m%s' % (result['Water Level'], result['Flow Rate'], result['Forecast Level'], warning), flush=True)
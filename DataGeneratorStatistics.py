@@ -0,0 +1,55 @@
+import numpy as np
+
+class QuantileSketch:
+    # A mergeable summary of a stream of values which can estimate quantiles in a single pass.
+    # The distinct values and how many times each was seen are kept, so while there are at most maxSize distinct values
+    # (always the case for the generated data, which is rounded to 3 decimal places) the quantiles are exact and match pandas.
+    # Beyond maxSize, neighbouring values are merged into groups of roughly equal count, so memory stays bounded.
+    # The rank of an estimated quantile is then within about 1 / maxSize of q (the tests check 2 / maxSize).
+
+    def __init__(self, maxSize : int = 100000):
+        self.maxSize = maxSize
+        self.values = np.zeros(0)
+        self.counts = np.zeros(0)
+
+    def add(self, values):
+        # Add an array of values to the sketch. NaN values are ignored, as pandas does.
+        values = np.asarray(values, dtype=float)
+        values, counts = np.unique(values[~np.isnan(values)], return_counts=True)
+        self.combine(values, counts)
+
+    def merge(self, other):
+        # Merge another sketch into this one, e.g. a sketch of a different chunk of the data.
+        self.combine(other.values, other.counts)
+
+    def combine(self, values, counts):
+        values, inverse = np.unique(np.concatenate([self.values, values]), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts]), minlength=len(values))
+        self.values = values
+        if len(self.values) > self.maxSize:
+            self.compress()
+
+    def compress(self):
+        # Merge neighbouring values into maxSize groups of roughly equal count, each represented by its weighted mean.
+        cumulative = np.cumsum(self.counts)
+        group = np.minimum((cumulative - self.counts) * self.maxSize // cumulative[-1], self.maxSize - 1).astype(int)
+        counts = np.bincount(group, weights=self.counts)
+        values = np.bincount(group, weights=self.values * self.counts) / np.where(counts > 0, counts, 1)
+        self.values = values[counts > 0]
+        self.counts = counts[counts > 0]
+
+    def count(self):
+        return self.counts.sum()
+
+    def quantile(self, q : float):
+        # Estimate the q quantile using linear interpolation between the closest ranks (the same as pandas' default).
+        n = self.count()
+        if n == 0:
+            return np.nan
+
+        position = (n - 1) * q
+        lower = np.floor(position)
+        cumulative = np.cumsum(self.counts)
+        lowerValue = self.values[np.searchsorted(cumulative, lower, side='right')]
+        upperValue = self.values[np.searchsorted(cumulative, min(lower + 1, n - 1), side='right')]
+        return lowerValue + (position - lower) * (upperValue - lowerValue)
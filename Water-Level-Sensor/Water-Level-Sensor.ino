@@ -70,6 +70,9 @@ void loop() {
     lcd.setCursor(0, 1);
     lcd.print(test/c2);
     lcd.print("cm");
+
+    // Send the reading (cm) over serial, one per line, for DataGeneratorSensor.py.
+    Serial.println(test/c2);
   }
   
   
@@ -0,0 +1,139 @@
+# Benchmarks for every stage of the DataGenerator pipeline.
+# Runs offline on synthetic rainfall and small synthetic versions of the real data CSVs, so no /home/iain paths are needed.
+#
+# Usage:
+# >>> python3 benchmarks/benchmark.py --output results.json
+# >>> python3 benchmarks/benchmark.py --output new.json --compare results.json --threshold 1.25
+# With --compare, the script exits with status 1 if any stage is more than threshold times slower than in the baseline.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test'))
+
+from DataGenerator import DataGenerator
+from DataGeneratorOutput import createOutput
+from DataGeneratorPredictors import Predictors
+from fixtures import createFixtures, syntheticRainfall
+
+# Numbers of days of input each size dependent stage is timed at.
+DAY_COUNTS = [1, 100, 3125]
+
+# The output writers timed, as (format, stage name). Parquet is skipped if pyarrow isn't installed.
+OUTPUT_WRITERS = [('csv', 'CsvOutput'), ('npy', 'NpyOutput'), ('parquet', 'ParquetOutput')]
+
+def timeit(function, repeat : int = 3):
+    # The fastest of `repeat` runs, in seconds.
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def runBenchmarks(workingDirectory : str, dayCounts : list() = DAY_COUNTS, repeat : int = 3):
+    # Time every stage. Returns a dictionary of stage name to seconds.
+    results = {}
+    dataDirectory = os.path.join(workingDirectory, 'Real Data')
+    cacheDirectory = os.path.join(workingDirectory, 'Model Cache')
+    outputDirectory = os.path.join(workingDirectory, 'Generated Data')
+    os.makedirs(outputDirectory, exist_ok=True)
+    createFixtures(dataDirectory)
+
+    results['Predictors() fit'] = timeit(lambda: Predictors(dataDirectory=dataDirectory, useCache=False), repeat)
+    Predictors(dataDirectory=dataDirectory, cacheDirectory=cacheDirectory)
+    results['Predictors() cached'] = timeit(lambda: Predictors(dataDirectory=dataDirectory, cacheDirectory=cacheDirectory), repeat)
+    predictors = Predictors(seed=0, dataDirectory=dataDirectory, cacheDirectory=cacheDirectory)
+
+    for days in dayCounts:
+        rainfall = syntheticRainfall(days)
+        levels = np.random.default_rng(2).uniform(0.1, 2.5, days * 96)
+        waterDifferences = np.random.default_rng(3).uniform(-2000000, 2000000, days)
+        suffix = ' @ ' + str(days) + ' days'
+
+        results['generateQuarterHourlyFlow' + suffix] = timeit(lambda: [predictors.generateQuarterHourlyFlow(level) for level in levels], repeat)
+        results['generateQuarterHourlyFlowBatch' + suffix] = timeit(lambda: predictors.generateQuarterHourlyFlowBatch(levels), repeat)
+        results['generateLevelDerivativeFromWaterDifference' + suffix] = timeit(lambda: [predictors.generateLevelDerivativeFromWaterDifference(w) for w in waterDifferences], repeat)
+
+        # One day of the fixed-point loop, repeated for each day (without carrying the level between days).
+        def simulateDays():
+            for i in range(days):
+                DataGenerator(numOfSamples=96, rainfall=rainfall[i*96:(i+1)*96], startingWaterLevel=0.5, predictors=predictors).simulateDay(maxPasses=35)
+        results['simulateDay (35 passes)' + suffix] = timeit(simulateDays, repeat)
+
+        dg = DataGenerator(numOfSamples=days * 96, rainfall=rainfall, startingWaterLevel=0.5, predictors=predictors, outputDirectory=outputDirectory)
+        results['simulate (tolerance 0.001)' + suffix] = timeit(lambda: dg.simulate(tolerance=0.001), repeat)
+
+        flowRates, waterLevels, passes, concentrations = dg.simulate(tolerance=0.001)
+        results['write_to_qtrhrl_csv' + suffix] = timeit(lambda: dg.write_to_qtrhrl_csv(flowRates, waterLevels), repeat)
+        results['write_to_day_csv' + suffix] = timeit(lambda: dg.write_to_day_csv(flowRates, waterLevels), repeat)
+
+        # Each output writer, given one day at a time as DataGenerator.py does (including closing the files).
+        columns = {'Precipitation': rainfall, 'Flow Rate': np.ravel(flowRates), 'Water Level': np.ravel(waterLevels)}
+        def writeDays(outputFormat):
+            with createOutput(outputFormat, os.path.join(outputDirectory, outputFormat)) as output:
+                for i in range(days):
+                    output.writeDay({column: values[i*96:(i+1)*96] for column, values in columns.items()})
+        for outputFormat, name in OUTPUT_WRITERS:
+            try:
+                results[name + ' writeDay' + suffix] = timeit(lambda: writeDays(outputFormat), repeat)
+            except ImportError:
+                print('Skipping ' + name + ' (pyarrow is not installed)')
+
+        quarterHourlyPath = os.path.join(outputDirectory, 'Quarter Hourly Generated Data.csv')
+        simplifiedPath = os.path.join(outputDirectory, 'Simplified Quarter Hourly Data.csv')
+        results['simplifyData' + suffix] = timeit(lambda: dg.simplifyData(quarterHourlyPath, simplifiedPath), repeat)
+
+    return results
+
+def compareResults(results : dict, baseline : dict, threshold : float, minimumSeconds : float = 0.001):
+    # Return the stages which are more than threshold times slower than in the baseline.
+    # Slowdowns smaller than minimumSeconds are ignored, as the fastest stages are mostly timer noise.
+    regressions = []
+    for stage, seconds in results.items():
+        if stage in baseline and seconds > baseline[stage] * threshold and seconds - baseline[stage] > minimumSeconds:
+            regressions.append((stage, baseline[stage], seconds))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark every stage of the DataGenerator pipeline.')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file to compare the results against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Fail if a stage takes more than this many times as long as the baseline')
+    parser.add_argument('--min-seconds', type=float, default=0.001, help='Ignore slowdowns smaller than this many seconds')
+    parser.add_argument('--days', type=int, nargs='+', default=DAY_COUNTS, help='Numbers of days of input to time each stage at')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to run each stage (the fastest is kept)')
+    args = parser.parse_args()
+
+    workingDirectory = tempfile.mkdtemp(prefix='IEL-benchmark-')
+    try:
+        results = runBenchmarks(workingDirectory, args.days, args.repeat)
+    finally:
+        shutil.rmtree(workingDirectory, ignore_errors=True)
+
+    for stage, seconds in results.items():
+        print('%-60s %10.4f s' % (stage, seconds))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                       'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compareResults(results, baseline, args.threshold, args.min_seconds)
+        for stage, before, after in regressions:
+            print('REGRESSION: %s took %.4f s (baseline %.4f s, %.2fx)' % (stage, after, before, after / before))
+        if len(regressions) > 0:
+            sys.exit(1)
+        print('No stage is more than %.2fx slower than the baseline' % args.threshold)
@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+# The modules are at the top of the repository rather than in a package, so make them importable from the tests.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataGeneratorPredictors import Predictors
+from fixtures import createFixtures
+
+@pytest.fixture(scope='session')
+def realDataDirectory(tmp_path_factory):
+    # Synthetic real data CSVs (see fixtures.createFixtures), created once for every test.
+    directory = str(tmp_path_factory.mktemp('real'))
+    createFixtures(directory, days=50)
+    return directory
+
+@pytest.fixture(scope='session')
+def predictors(realDataDirectory):
+    # Predictors fitted to the synthetic real data. Tests which need a particular random number stream should create their own.
+    return Predictors(seed=0, dataDirectory=realDataDirectory)
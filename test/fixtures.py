@@ -0,0 +1,31 @@
+# Synthetic data for the tests and benchmarks, so neither needs the real data in /home/iain.
+import os
+import numpy as np
+import pandas as pd
+from DataGeneratorPredictors import QUARTER_HOURLY_FILES, DAILY_FILES
+
+def writeSEPAExport(path : str, timestamps, values):
+    # Write a series in the same layout as the SEPA exports (#Timestamp;Value;Quality Code).
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame({'#Timestamp': timestamps.strftime('%Y-%m-%dT%H:%M:%S.000Z'), 'Value': np.round(values, 3), 'Quality Code': 50}).to_csv(path, sep=';', index=False)
+
+def createFixtures(directory : str, days : int = 400, seed : int = 0):
+    # Create small synthetic versions of the real data CSVs, with a rating curve similar to the real river.
+    rng = np.random.default_rng(seed)
+
+    samples = days * 96
+    level = np.clip(0.5 + np.cumsum(rng.normal(0, 0.01, samples)), 0.15, 2.2)
+    flow = np.maximum(0, 2*level**3 + 3*level**2 + level - 0.3 + rng.normal(0, 0.2, samples))
+    rain = np.where(rng.random(samples) < 0.2, rng.exponential(0.5, samples), 0.0)
+    timestamps = pd.date_range('2015-01-01', periods=samples, freq='15min')
+    for name, values in [('Flow Rate', flow), ('Precipitation', rain), ('Water Level', level)]:
+        writeSEPAExport(os.path.join(directory, QUARTER_HOURLY_FILES[name]), timestamps, values)
+
+    dailyTimestamps = pd.date_range('2015-01-01 09:00', periods=days, freq='D')
+    for name, values in [('Flow Rate', flow.reshape(days, 96).mean(axis=1)), ('Precipitation', rain.reshape(days, 96).sum(axis=1)),
+                         ('Water Level', level.reshape(days, 96).mean(axis=1))]:
+        writeSEPAExport(os.path.join(directory, DAILY_FILES[name]), dailyTimestamps, values)
+
+def syntheticRainfall(days : int, seed : int = 1):
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random(days * 96) < 0.2, rng.exponential(0.5, days * 96), 0.0)
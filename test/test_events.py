@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+from DataGeneratorEvents import EventIndex, findEvents
+
+THRESHOLD = 1.0
+
+def bruteForceEvents(levels, rainfall):
+    # Each run of samples at or above the threshold as (start, end, peak, rainfall), one sample at a time.
+    events = []
+    start = None
+    for i, level in enumerate(list(levels) + [-np.inf]):
+        if level >= THRESHOLD and start is None:
+            start = i
+        elif level < THRESHOLD and start is not None:
+            events.append((start, i, max(levels[start:i]), sum(rainfall[start:i])))
+            start = None
+    return events
+
+@pytest.fixture
+def series():
+    # Three years of levels which cross the threshold often, including at the very start and end.
+    rng = np.random.default_rng(0)
+    samples = 3 * 365 * 96
+    levels = 1.0 + 0.3 * np.sin(np.arange(samples) / 500) * np.sin(np.arange(samples) / 37) + rng.normal(0, 0.02, samples)
+    levels[:10] = 1.5
+    levels[-10:] = 1.5
+    rainfall = np.where(rng.random(samples) < 0.2, rng.exponential(0.5, samples), 0.0)
+    return levels, rainfall
+
+def assertSameEvents(events, expected):
+    assert len(events) == len(expected)
+    np.testing.assert_array_equal(events['Start'], [event[0] for event in expected])
+    np.testing.assert_array_equal(events['End'], [event[1] for event in expected])
+    np.testing.assert_array_equal(events['Peak'], [event[2] for event in expected])
+    np.testing.assert_allclose(events['Rainfall'], [event[3] for event in expected], rtol=1e-9, atol=1e-9)
+
+def addInChunks(index, levels, rainfall, chunkSizes):
+    first = 0
+    for size in chunkSizes:
+        index.add(levels[first:first + size], rainfall[first:first + size])
+        first += size
+    index.add(levels[first:], rainfall[first:])
+
+def test_find_events_matches_a_loop(series):
+    levels, rainfall = series
+    assertSameEvents(findEvents(levels, THRESHOLD, rainfall), bruteForceEvents(levels, rainfall))
+
+@pytest.mark.parametrize('chunkSize', [1, 7, 96, 1000])
+def test_chunks_give_the_same_events_as_the_whole_series(series, chunkSize):
+    levels, rainfall = series
+    whole = EventIndex(THRESHOLD)
+    whole.add(levels, rainfall)
+    chunked = EventIndex(THRESHOLD)
+    addInChunks(chunked, levels[:20000], rainfall[:20000], [chunkSize] * (20000 // chunkSize))
+    addInChunks(chunked, levels[20000:], rainfall[20000:], [96] * ((len(levels) - 20000) // 96))
+
+    # The series ends above the threshold, so its last event is still open and ends at the last sample.
+    assert chunked.openEvent is not None
+    assert chunked.samples == whole.samples == len(levels)
+    assertSameEvents(chunked.events, bruteForceEvents(levels, rainfall))
+    assertSameEvents(whole.events, bruteForceEvents(levels, rainfall))
+
+def test_saved_index_with_an_open_event_carries_on(series, tmp_path):
+    levels, rainfall = series
+    # Stop part way through an event.
+    split = int(np.flatnonzero(levels >= THRESHOLD)[5000])
+    assert levels[split - 1] >= THRESHOLD and levels[split] >= THRESHOLD
+    index = EventIndex(THRESHOLD, startTimestamp='2019-06-01T00:00:00')
+    index.add(levels[:split], rainfall[:split])
+    assert index.openEvent is not None
+    index.save(str(tmp_path / 'events.npz'))
+
+    loaded = EventIndex.load(str(tmp_path / 'events.npz'))
+    assert loaded.openEvent is not None and loaded.samples == split and loaded.startTimestamp == '2019-06-01T00:00:00'
+    loaded.add(levels[split:], rainfall[split:])
+    assertSameEvents(loaded.events, bruteForceEvents(levels, rainfall))
+
+def test_counts_per_year_and_return_periods(series):
+    levels, rainfall = series
+    index = EventIndex(THRESHOLD, startTimestamp='2019-12-31T00:00:00')
+    addInChunks(index, levels, rainfall, [96] * (len(levels) // 96))
+    expected = bruteForceEvents(levels, rainfall)
+
+    # The series covers the last day of 2019 to the end of 2022.
+    starts = pd.to_datetime('2019-12-31') + pd.to_timedelta([event[0] * 15 for event in expected], unit='min')
+    counts = index.countsPerYear()
+    assert list(counts.index) == [2019, 2020, 2021, 2022]
+    assert counts.tolist() == [int(np.sum(starts.year == year)) for year in counts.index]
+    assert counts.sum() == len(expected)
+
+    years = len(levels) / (96 * 365.25)
+    peaks = np.array([event[2] for event in expected])
+    assert index.returnPeriod() == pytest.approx(years / len(expected))
+    assert index.returnPeriod(1.2) == pytest.approx(years / np.sum(peaks >= 1.2))
+    assert index.returnPeriod(10) == np.inf
+    with pytest.raises(ValueError):
+        index.returnPeriod(0.5)
+
+    periods = index.returnPeriods()
+    np.testing.assert_array_equal(periods['Peak'], np.sort(peaks)[::-1])
+    assert periods['Return Period'].iloc[0] == pytest.approx(years)
+
+    longest = index.longest()
+    durations = [event[1] - event[0] for event in expected]
+    assert longest['Duration'] == max(durations) / 4
@@ -0,0 +1,35 @@
+import numpy as np
+from DataGenerator import clampedCumulativeLevel
+
+def clampLoop(startingLevel, levelDerivative, minimum=0.1, maximum=2.6):
+    # The original loop: each level is the last level plus the derivative, clamped to [minimum, maximum].
+    levels = [startingLevel]
+    for derivative in levelDerivative[1:]:
+        levels.append(min(max(levels[-1] + derivative, minimum), maximum))
+    return np.array(levels)
+
+def test_matches_the_loop_without_clamping():
+    # The cumulative sum adds the derivatives before the starting level, so the levels can differ from the loop by rounding.
+    derivative = np.random.default_rng(0).normal(0, 0.001, 96)
+    np.testing.assert_allclose(clampedCumulativeLevel(0.5, derivative), clampLoop(0.5, derivative), rtol=0, atol=1e-12)
+
+def test_matches_the_loop_when_the_level_is_clamped():
+    # Falls through 0.1, then rises through 2.6.
+    derivative = np.concatenate([np.full(48, -0.05), np.full(48, 0.1)])
+    levels = clampedCumulativeLevel(0.5, derivative)
+    np.testing.assert_allclose(levels, clampLoop(0.5, derivative), rtol=0, atol=1e-12)
+    assert levels.min() == 0.1 and levels.max() == 2.6
+
+def test_matches_the_loop_for_every_ensemble_member():
+    # Members which hit 0.1, hit 2.6, hit both and hit neither, with one starting level each.
+    rng = np.random.default_rng(1)
+    derivative = np.stack([np.full(96, -0.02), np.full(96, 0.05), np.concatenate([np.full(48, 0.1), np.full(48, -0.1)]),
+                           rng.normal(0, 0.001, 96)])
+    startingLevels = np.array([0.5, 2.0, 1.0, 0.8])
+    levels = clampedCumulativeLevel(startingLevels, derivative)
+    assert levels.shape == (4, 96)
+    for member in range(4):
+        np.testing.assert_allclose(levels[member], clampLoop(startingLevels[member], derivative[member]), rtol=0, atol=1e-12)
+
+    # The member which never hits a bound is left as the cumulative sum gave it.
+    np.testing.assert_array_equal(levels[3], startingLevels[3] + np.cumsum(np.concatenate([[0], derivative[3][1:]])))
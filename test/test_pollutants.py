@@ -0,0 +1,73 @@
+import numpy as np
+import copy
+import pytest
+from DataGenerator import DataGenerator, linearRecurrence
+from DataGeneratorScenarios import runScenarios
+from fixtures import syntheticRainfall
+from DataGeneratorPredictors import getRainfallMultiplier
+
+def massBalance(flowRate, damn, rainfall, damnConcentration, rainfallConcentration, mixingVolume, mass=0.0):
+    # The mass balance one sample at a time.
+    concentrations = []
+    for q, d, r in zip(flowRate, damn, rainfall):
+        load = d*damnConcentration + r*getRainfallMultiplier()/900*rainfallConcentration
+        mass = (mass + load*900) / (1 + q*900/mixingVolume)
+        concentrations.append(mass / mixingVolume)
+    return np.array(concentrations), mass
+
+def test_linear_recurrence_matches_a_loop():
+    rng = np.random.default_rng(0)
+    factors = np.concatenate([rng.uniform(0.5, 1, 100), rng.uniform(1e-12, 1e-9, 100), np.ones(50)])
+    additions = rng.uniform(0, 10, len(factors))
+    expected = []
+    x = 3.0
+    for a, b in zip(factors, additions):
+        x = a*x + b
+        expected.append(x)
+    np.testing.assert_allclose(linearRecurrence(3.0, factors, additions), expected, rtol=1e-12)
+
+def test_concentrations_follow_the_mass_balance(predictors):
+    rng = np.random.default_rng(1)
+    samples = 96 * 3
+    flowRate = rng.uniform(0, 20, samples)
+    damn = np.where(np.arange(samples) % 50 < 5, 30.0, 0.0)
+    rainfall = np.where(rng.random(samples) < 0.2, rng.exponential(0.5, samples), 0.0)
+    dg = DataGenerator(numOfSamples=samples, rainfall=rainfall.tolist(), volumeOfWaterComingFromDamn=damn.tolist(), predictors=predictors,
+                       pollutants=[('Damn', 'Nitrate', 2.5), ('Rainfall', 'Nitrate', 0.5)], mixingVolume=20000)
+
+    # Called a day at a time, the pollutants left in the river are carried into the next day.
+    concentrations = []
+    for day in range(3):
+        dg.rainfall = rainfall[day*96:].tolist()
+        dg.volumeOfWaterComingFromDamn = damn[day*96:].tolist()
+        concentrations.append(dg.calculate_quarter_hourly_concentrations(flowRate[day*96:(day+1)*96])['Concentration Nitrate'])
+
+    expected, mass = massBalance(flowRate, damn, rainfall, 2.5, 0.5, 20000)
+    np.testing.assert_allclose(np.concatenate(concentrations), expected, rtol=1e-10)
+    assert float(dg.pollutantMass[0]) == pytest.approx(mass, rel=1e-10)
+
+    # With no inflows the pollutants are washed out, faster the higher the flow.
+    slow = DataGenerator(numOfSamples=96, rainfall=[0.0] * 96, predictors=predictors, pollutants=[('Damn', 'Nitrate', 2.5)], mixingVolume=20000)
+    fast = DataGenerator(numOfSamples=96, rainfall=[0.0] * 96, predictors=predictors, pollutants=[('Damn', 'Nitrate', 2.5)], mixingVolume=20000)
+    slow.pollutantMass = fast.pollutantMass = np.array([20000.0])
+    slowConcentrations = slow.calculate_quarter_hourly_concentrations(np.full(96, 1.0))['Concentration Nitrate']
+    fastConcentrations = fast.calculate_quarter_hourly_concentrations(np.full(96, 10.0))['Concentration Nitrate']
+    assert np.all(np.diff(slowConcentrations) < 0)
+    assert np.all(fastConcentrations < slowConcentrations)
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_scenarios_match_iterate_days(predictors, workers):
+    # Each scenario's concentrations should be the ones its days were generated with, starting from a clean river.
+    rainfall = syntheticRainfall(4).tolist()
+    scenarios = {'Dam': {'volumeOfWaterComingFromDamn': [1.0] * len(rainfall), 'pollutants': [('Damn', 'N', 2.0)]},
+                 'Rain': {'pollutants': [('Rainfall', 'N', 0.5), ('Damn', 'P', 1.0)], 'startingWaterLevel': 0.8}}
+    results = runScenarios(scenarios, predictors, rainfall, seed=3, workers=workers)
+
+    for (name, scenario), seedSequence in zip(scenarios.items(), np.random.SeedSequence(3).spawn(len(scenarios))):
+        scenarioPredictors = copy.copy(predictors)
+        scenarioPredictors.rng = np.random.default_rng(seedSequence)
+        dg = DataGenerator(numOfSamples=len(rainfall), rainfall=rainfall, predictors=scenarioPredictors, **scenario)
+        days = list(dg.iterateDays())
+        assert len(days) == 4
+        for column in dg.outputColumns():
+            np.testing.assert_array_equal(results.loc[name][column].to_numpy(), np.concatenate([columns[column] for day, columns, passes in days]))
@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import pytest
+from DataGeneratorPredictors import Predictors, loadRealData, QUARTER_HOURLY_FILES, DAILY_FILES, FIT_SETTINGS
+from fixtures import createFixtures
+
+DAYS = 400
+SPLIT_DAYS = 300
+
+def truncateFile(source : str, destination : str, rows : int):
+    # Copy the header and the first `rows` rows of a SEPA export.
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    with open(source, 'r') as f:
+        lines = f.readlines()
+    with open(destination, 'w') as f:
+        f.writelines(lines[:rows + 1])
+
+@pytest.fixture(scope='module')
+def realData(tmp_path_factory):
+    # All of the synthetic real data, and a copy of only the first SPLIT_DAYS days of it.
+    fullDirectory = str(tmp_path_factory.mktemp('full'))
+    splitDirectory = str(tmp_path_factory.mktemp('split'))
+    createFixtures(fullDirectory, days=DAYS)
+    for files, rowsPerDay in [(QUARTER_HOURLY_FILES, 96), (DAILY_FILES, 1)]:
+        for name in files.values():
+            truncateFile(os.path.join(fullDirectory, name), os.path.join(splitDirectory, name), SPLIT_DAYS * rowsPerDay)
+    return fullDirectory, splitDirectory
+
+def test_update_matches_a_full_refit(realData):
+    fullDirectory, splitDirectory = realData
+    refit = Predictors(dataDirectory=fullDirectory, useCache=False)
+    updated = Predictors(dataDirectory=splitDirectory, useCache=False)
+
+    # Add the remaining days, in two batches to check the carried over last day.
+    quarterHourly = loadRealData(QUARTER_HOURLY_FILES, fullDirectory).iloc[SPLIT_DAYS * 96:]
+    daily = loadRealData(DAILY_FILES, fullDirectory).iloc[SPLIT_DAYS:]
+    middle = (DAYS - SPLIT_DAYS) // 2
+    updated.update(quarterHourly.iloc[:middle * 96], daily.iloc[:middle])
+    updated.update(quarterHourly.iloc[middle * 96:], daily.iloc[middle:])
+
+    np.testing.assert_allclose(updated.flowCoefficients, refit.flowCoefficients, rtol=1e-11, atol=1e-11)
+    np.testing.assert_allclose(updated.highFlowOffset, refit.highFlowOffset, rtol=1e-11, atol=1e-11)
+    np.testing.assert_allclose(updated.levelCoefficients, refit.levelCoefficients, rtol=1e-11, atol=1e-15)
+
+    # After an update std is the residual standard deviation over all of the days (not the held out test split).
+    typical = refit.dailyData[refit.dailyData['Water Difference'].abs() < FIT_SETTINGS['maxWaterDifference']]
+    residuals = typical['Level Difference'] - np.polynomial.polynomial.polyval(typical['Water Difference'], refit.levelCoefficients)
+    np.testing.assert_allclose(updated.std, np.sqrt(np.sum(residuals ** 2) / (len(residuals) - 1)), rtol=1e-9)
+
+def test_update_changes_the_cache_key(realData):
+    fullDirectory, splitDirectory = realData
+    predictors = Predictors(dataDirectory=splitDirectory, useCache=False)
+    original = predictors.cacheKey
+    daily = loadRealData(DAILY_FILES, fullDirectory).iloc[SPLIT_DAYS:]
+
+    predictors.update(dailyRows=daily.iloc[:10])
+    first = predictors.cacheKey
+    assert first != original
+
+    # Nothing to add leaves the key alone, and the same update from the same state gives the same key.
+    predictors.update()
+    assert predictors.cacheKey == first
+    other = Predictors(dataDirectory=splitDirectory, useCache=False)
+    other.update(dailyRows=daily.iloc[:10])
+    assert other.cacheKey == first
+
+def test_updated_models_can_be_loaded_again(realData, tmp_path):
+    fullDirectory, splitDirectory = realData
+    daily = loadRealData(DAILY_FILES, fullDirectory).iloc[SPLIT_DAYS:]
+    quarterHourly = loadRealData(QUARTER_HOURLY_FILES, fullDirectory).iloc[SPLIT_DAYS * 96:]
+    cacheDirectory = str(tmp_path)
+
+    updated = Predictors(dataDirectory=splitDirectory, cacheDirectory=cacheDirectory)
+    updated.update(quarterHourly.iloc[:960], daily.iloc[:10])
+
+    # A new Predictors for the same real data still loads the original models, unless it is given the updated key.
+    assert Predictors(dataDirectory=splitDirectory, cacheDirectory=cacheDirectory).cacheKey != updated.cacheKey
+    loaded = Predictors(dataDirectory=splitDirectory, cacheDirectory=cacheDirectory, cacheKey=updated.cacheKey)
+    assert loaded.cacheKey == updated.cacheKey
+    np.testing.assert_array_equal(loaded.flowCoefficients, updated.flowCoefficients)
+    np.testing.assert_array_equal(loaded.levelCoefficients, updated.levelCoefficients)
+    assert loaded.std == updated.std and loaded.lastDailyRow == updated.lastDailyRow
+
+    # The loaded models can be updated again, giving the same models as carrying on in the first process.
+    updated.update(dailyRows=daily.iloc[10:])
+    loaded.update(dailyRows=daily.iloc[10:])
+    assert loaded.cacheKey == updated.cacheKey
+    np.testing.assert_array_equal(loaded.levelCoefficients, updated.levelCoefficients)
+
+    with pytest.raises(FileNotFoundError):
+        Predictors(dataDirectory=splitDirectory, cacheDirectory=cacheDirectory, cacheKey='0123456789abcdef')
@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pytest
+from DataGenerator import DataGenerator
+
+def writeRainfall(path : str, values : list()):
+    # A SEPA export of quarter-hourly rainfall starting at midnight on 2020-01-01.
+    with open(path, 'w') as f:
+        f.write('#Timestamp;Value;Quality Code\n')
+        for i, value in enumerate(values):
+            f.write('2020-01-01T%02d:%02d:00.000Z;%s;50\n' % (i // 4, i % 4 * 15, value))
+
+def failingParse(*args, **kwargs):
+    raise AssertionError('The CSV was parsed instead of reading the sidecar')
+
+@pytest.fixture
+def dg(predictors):
+    return DataGenerator(numOfSamples=96, predictors=predictors)
+
+def test_invalid_rows_are_skipped_and_recorded(dg, tmp_path):
+    path = str(tmp_path / 'rainfall.csv')
+    writeRainfall(path, ['0.1', '---', '0.3', '', '0.5', '0.6', 'x'])
+
+    rainfall, samples = dg.read_rainfall_from_csv(path, samples=3, useSidecar=False)
+    assert rainfall == [0.1, 0.3, 0.5] and samples == 3
+    assert dg.invalidRainfallRows.tolist() == [1, 3]
+    assert dg.rainfallTimestamps.tolist() == list(np.array(['2020-01-01T00:00', '2020-01-01T00:30', '2020-01-01T01:00'], dtype='datetime64[ms]'))
+
+    rainfall, samples = dg.read_rainfall_from_csv(path, samples=10, useSidecar=False)
+    # Only invalid rows before the last sample returned are recorded.
+    assert rainfall == [0.1, 0.3, 0.5, 0.6]
+    assert dg.invalidRainfallRows.tolist() == [1, 3]
+
+def test_sidecar_is_read_instead_of_the_csv(dg, tmp_path):
+    path = str(tmp_path / 'rainfall.csv')
+    writeRainfall(path, ['0.1', '---', '0.3', '0.4'])
+    first = dg.read_rainfall_from_csv(path, samples=10)
+    assert os.path.exists(path + '.rainfall.npy') and os.path.exists(path + '.rainfall.json')
+
+    dg.parse_rainfall_csv = failingParse
+    assert dg.read_rainfall_from_csv(path, samples=10) == first
+    assert dg.invalidRainfallRows.tolist() == [1]
+
+def test_changed_csv_is_parsed_again(dg, tmp_path):
+    path = str(tmp_path / 'rainfall.csv')
+    writeRainfall(path, ['0.1', '0.2', '0.3'])
+    dg.read_rainfall_from_csv(path, samples=10)
+
+    # A different size.
+    writeRainfall(path, ['0.1', '0.2', '0.3', '0.4'])
+    assert dg.read_rainfall_from_csv(path, samples=10)[0] == [0.1, 0.2, 0.3, 0.4]
+
+    # The same size, but modified later.
+    writeRainfall(path, ['0.5', '0.6', '0.7', '0.8'])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert dg.read_rainfall_from_csv(path, samples=10)[0] == [0.5, 0.6, 0.7, 0.8]
+
+def test_partly_parsed_csv_is_parsed_again_for_more_samples(dg, tmp_path):
+    path = str(tmp_path / 'rainfall.csv')
+    writeRainfall(path, [str(i / 10) for i in range(20)])
+
+    # Parsing stops once there are enough samples, so the sidecar only covers the start of the file.
+    assert dg.read_rainfall_from_csv(path, samples=5)[1] == 5
+    parse = dg.parse_rainfall_csv
+    dg.parse_rainfall_csv = failingParse
+    assert dg.read_rainfall_from_csv(path, samples=5)[1] == 5
+
+    # More samples than the sidecar has can only come from the CSV.
+    with pytest.raises(AssertionError):
+        dg.read_rainfall_from_csv(path, samples=15)
+    dg.parse_rainfall_csv = parse
+    rainfall, samples = dg.read_rainfall_from_csv(path, samples=15)
+    assert samples == 15 and rainfall[-1] == 1.4
@@ -0,0 +1,82 @@
+import os
+import filecmp
+import itertools
+import numpy as np
+import pytest
+from DataGeneratorPredictors import Predictors
+from DataGenerator import DataGenerator
+from fixtures import syntheticRainfall
+
+DAYS = 10
+POLLUTANTS = [('Damn', 'Nitrate', 2.5), ('Rainfall', 'Nitrate', 0.5)]
+
+@pytest.fixture(scope='module')
+def series():
+    rainfall = syntheticRainfall(DAYS).tolist()
+    timestamps = np.datetime64('2020-01-01', 'ms') + np.arange(DAYS * 96) * np.timedelta64(15, 'm')
+    damn = np.where(np.arange(DAYS * 96) % 200 < 20, 50000.0, 0.0).tolist()
+    return rainfall, timestamps, damn
+
+def outputFiles(directory : str):
+    # Every csv and npy file written to an output directory, relative to it.
+    return sorted(os.path.relpath(os.path.join(root, name), directory) for root, directories, names in os.walk(directory)
+                  for name in names if name.endswith(('.csv', '.npy')))
+
+def generate(realDataDirectory, outputDirectory, rainfall, timestamps, damn, resume : bool, crashAfter : int = None):
+    # The day loop of DataGenerator.py. With crashAfter, stop after that day has been checkpointed and one more day has been written.
+    predictors = Predictors(seed=5, dataDirectory=realDataDirectory)
+    dg = DataGenerator(numOfSamples=len(rainfall), rainfall=rainfall, startingWaterLevel=0.5, volumeOfWaterComingFromDamn=damn,
+                       pollutants=POLLUTANTS, predictors=predictors, outputDirectory=outputDirectory, outputFormats=['csv', 'npy'])
+    firstDay = 0
+    checkpoint = dg.loadCheckpoint() if resume else None
+    if checkpoint is not None:
+        firstDay = dg.resumeFromCheckpoint(checkpoint, timestamps)
+        timestamps = dg.rainfallTimestamps
+
+    with dg.openOutput(resume=None if checkpoint is None else checkpoint['outputs']) as output:
+        for day, columns, passes in dg.iterateDays(dg.numOfSamples // 96, tolerance=0.001, firstDay=firstDay):
+            output.writeDay(columns)
+            dg.saveCheckpoint(day + 1, columns['Water Level'][-1], output, timestamps[(day - firstDay) * 96 + 95])
+            if crashAfter is not None and day + 1 == crashAfter:
+                output.writeDay(columns)
+                return
+
+def test_resumed_run_matches_an_uninterrupted_run(realDataDirectory, series, tmp_path):
+    rainfall, timestamps, damn = series
+    single, split = str(tmp_path / 'single'), str(tmp_path / 'split')
+    generate(realDataDirectory, single, rainfall, timestamps, damn, resume=False)
+
+    # Generate the first 4 days, extend with all of the rainfall (stopping after day 7 with a day written past the checkpoint), then resume.
+    generate(realDataDirectory, split, rainfall[:4 * 96], timestamps[:4 * 96], damn[:4 * 96], resume=False)
+    generate(realDataDirectory, split, rainfall, timestamps, damn, resume=True, crashAfter=7)
+    generate(realDataDirectory, split, rainfall, timestamps, damn, resume=True)
+
+    names = outputFiles(single)
+    assert len(names) == 12 and outputFiles(split) == names
+    for name in names:
+        assert filecmp.cmp(os.path.join(single, name), os.path.join(split, name), shallow=False), name
+
+def test_resume_drops_the_generated_dam_releases(realDataDirectory, series, tmp_path):
+    rainfall, timestamps, damn = series
+    generate(realDataDirectory, str(tmp_path), rainfall[:3 * 96], timestamps[:3 * 96], damn[:3 * 96], resume=False)
+
+    dg = DataGenerator(numOfSamples=len(rainfall), rainfall=rainfall, volumeOfWaterComingFromDamn=damn, pollutants=POLLUTANTS,
+                       predictors=Predictors(seed=5, dataDirectory=realDataDirectory), outputDirectory=str(tmp_path), outputFormats=['csv', 'npy'])
+    assert dg.resumeFromCheckpoint(dg.loadCheckpoint(), timestamps) == 3
+    assert dg.volumeOfWaterComingFromDamn == damn[3 * 96:]
+    assert dg.rainfall == rainfall[3 * 96:]
+
+    # Dam releases from an iterator can't be lined up with the remaining rainfall.
+    dg.volumeOfWaterComingFromDamn = itertools.repeat(0.0)
+    with pytest.raises(ValueError):
+        dg.resumeFromCheckpoint(dg.loadCheckpoint(), timestamps)
+
+def test_resume_needs_the_same_columns(realDataDirectory, series, tmp_path):
+    rainfall, timestamps, damn = series
+    generate(realDataDirectory, str(tmp_path), rainfall[:96], timestamps[:96], damn[:96], resume=False)
+
+    # Different pollutants would append rows with different columns to the outputs.
+    dg = DataGenerator(numOfSamples=len(rainfall), rainfall=rainfall, pollutants=POLLUTANTS + [('Damn', 'Phosphate', 0.1)],
+                       predictors=Predictors(seed=5, dataDirectory=realDataDirectory), outputDirectory=str(tmp_path), outputFormats=['csv', 'npy'])
+    with pytest.raises(ValueError):
+        dg.loadCheckpoint()
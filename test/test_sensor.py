@@ -0,0 +1,71 @@
+import os
+import pty
+import time
+import tty
+import threading
+import pytest
+from DataGeneratorSensor import SensorMonitor, openSensor, readLines, monitorSensor
+
+def test_pty_lines_arrive_as_they_are_written():
+    # openSensor on the pty's device, with the test writing as the Arduino would.
+    master, slave = pty.openpty()
+    stream = openSensor(os.ttyname(slave))
+    os.close(slave)
+    lines = readLines(stream)
+    try:
+        # A line split across writes is only yielded once it is complete, and the \r of \r\n is dropped.
+        os.write(master, b'12.5\r\n13')
+        assert next(lines) == b'12.5'
+        os.write(master, b'.0\r\n1000,14\r\n')
+        assert next(lines) == b'13.0'
+        assert next(lines) == b'1000,14'
+    finally:
+        os.close(master)
+        stream.close()
+
+def test_pty_ends_when_the_writer_closes():
+    # Reading the master side of a pty raises EIO once the slave is closed. The lines already written
+    # (including a final line without a newline) are still read, then the stream ends.
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    os.write(slave, b'5\r\nhello\r\n7')
+    os.close(slave)
+    with os.fdopen(master, 'rb', buffering=0) as stream:
+        assert list(readLines(stream)) == [b'5', b'hello', b'7']
+
+def test_followed_file(tmp_path, predictors):
+    # A file which is still being written to is followed like tail -f until stop returns True.
+    path = str(tmp_path / 'readings.txt')
+    with open(path, 'wb') as f:
+        f.write(b'0,50\r\n')
+
+    def writer():
+        with open(path, 'ab', buffering=0) as f:
+            for data in [b'900,6', b'0\r\nstarting\r\n', b'1800,70\r\n']:
+                time.sleep(0.05)
+                f.write(data)
+    thread = threading.Thread(target=writer)
+    thread.start()
+
+    start = time.time()
+    monitor = SensorMonitor(predictors, horizon=900, property_flooding_level=0.9, low_lying_land_flooding_level=0.9)
+    with open(path, 'rb') as stream:
+        results = []
+        for result in monitorSensor(stream, monitor, pollInterval=0.01, stop=lambda: len(results) == 3 or time.time() - start > 5):
+            results.append(result)
+    thread.join()
+
+    # The partial "900,6" is joined with the "0" written later, and "starting" isn't a reading.
+    assert [result['Timestamp'] for result in results] == [0, 900, 1800]
+    assert [result['Water Level'] for result in results] == pytest.approx([0.5, 0.6, 0.7])
+    assert results[-1]['Level Trend'] == pytest.approx(0.1 / 900)
+    assert results[-1]['Forecast Level'] == pytest.approx(0.8)
+    assert not results[-1]['Property Flooding Forecast']
+    assert results[-1]['Time To Property Flooding'] == pytest.approx(1800)
+
+def test_unfollowed_file_stops_at_the_end(tmp_path):
+    path = str(tmp_path / 'readings.txt')
+    with open(path, 'wb') as f:
+        f.write(b'1\n2\r\n3')
+    with open(path, 'rb') as stream:
+        assert list(readLines(stream, follow=False)) == [b'1', b'2', b'3']
@@ -0,0 +1,112 @@
+import socket
+import datetime
+import threading
+import pytest
+from DataGeneratorSEPA import SEPAClient, SEPAError, LocalKiWISServer
+
+def utcToday():
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+@pytest.fixture
+def server():
+    with LocalKiWISServer() as server:
+        yield server
+
+def test_cache_hit_only_downloads_today(server, tmp_path):
+    with SEPAClient(server.url, str(tmp_path)) as client:
+        rainfall, samples = client.readRainfall('Dippen', 96 * 5)
+    assert samples == 96 * 5
+    assert server.requestCounts == {'getTimeseriesList': 1, 'getTimeseriesValues': 1}
+
+    # The ts_id and every complete day are cached, so only today (which is never complete) is downloaded again.
+    with SEPAClient(server.url, str(tmp_path)) as client:
+        again, samples = client.readRainfall('Dippen', 96 * 5)
+    assert again == rainfall
+    assert server.requestCounts == {'getTimeseriesList': 1, 'getTimeseriesValues': 2}
+
+def test_only_missing_days_are_downloaded(server, tmp_path):
+    today = utcToday()
+    day = lambda n: today - datetime.timedelta(days=n)
+    with SEPAClient(server.url, str(tmp_path)) as client:
+        client.getValues(1000, day(10), day(8))
+        client.getValues(1000, day(4), day(3))
+        assert server.requestCounts['getTimeseriesValues'] == 2
+
+        # Days 7 to 5 and 2 to 1 are missing, so they are downloaded in two requests.
+        rows = client.getValues(1000, day(10), day(1))
+        assert server.requestCounts['getTimeseriesValues'] == 4
+        assert len(rows) == 96 * 10
+
+        client.getValues(1000, day(10), day(1))
+        assert server.requestCounts['getTimeseriesValues'] == 4
+
+def test_interrupted_download_resumes_from_the_missing_chunk(server, tmp_path):
+    today = utcToday()
+    firstDay, lastDay = today - datetime.timedelta(days=6), today - datetime.timedelta(days=1)
+
+    class FailingClient(SEPAClient):
+        # Fails on the third chunk of values.
+        calls = 0
+        def request(self, parameters):
+            if parameters['request'] == 'getTimeseriesValues':
+                FailingClient.calls += 1
+                if FailingClient.calls == 3:
+                    raise SEPAError('Connection lost')
+            return SEPAClient.request(self, parameters)
+
+    with FailingClient(server.url, str(tmp_path), chunkDays=2) as client:
+        with pytest.raises(SEPAError):
+            client.getValues(1000, firstDay, lastDay)
+    assert server.requestCounts['getTimeseriesValues'] == 2
+
+    # The first two chunks were saved, so only the last chunk is downloaded.
+    with SEPAClient(server.url, str(tmp_path), chunkDays=2) as client:
+        rows = client.getValues(1000, firstDay, lastDay)
+    assert server.requestCounts['getTimeseriesValues'] == 3
+    assert len(rows) == 96 * 6
+
+def test_incomplete_recent_days_are_not_cached(tmp_path):
+    today = utcToday()
+    recent = today - datetime.timedelta(days=1)
+    old = today - datetime.timedelta(days=10)
+    published = {'done': False}
+
+    # The afternoon of every day is missing until it is "published".
+    def rainfall(t):
+        return 0.5 if published['done'] or t.hour < 12 else None
+
+    with LocalKiWISServer(rainfall=rainfall) as server:
+        with SEPAClient(server.url, str(tmp_path), publicationDelay=3) as client:
+            assert len(client.getValues(1000, recent, recent)) == 48
+            assert len(client.getValues(1000, old, old)) == 48
+            assert server.requestCounts['getTimeseriesValues'] == 2
+
+            # The recent day is downloaded again and now complete. The old day is past the publication delay, so it was cached as it was.
+            published['done'] = True
+            assert len(client.getValues(1000, recent, recent)) == 96
+            assert len(client.getValues(1000, old, old)) == 48
+            assert server.requestCounts['getTimeseriesValues'] == 3
+
+            # Now the recent day is complete it is cached.
+            client.getValues(1000, recent, recent)
+            assert server.requestCounts['getTimeseriesValues'] == 3
+
+def test_bad_responses_raise_sepa_error(tmp_path):
+    # A server which replies with something that isn't HTTP, giving http.client.BadStatusLine.
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+
+    def reply():
+        for i in range(2):
+            connection, address = listener.accept()
+            connection.recv(65536)
+            connection.sendall(b'not http\r\n\r\n')
+            connection.close()
+    threading.Thread(target=reply, daemon=True).start()
+
+    url = 'http://127.0.0.1:' + str(listener.getsockname()[1]) + '/KiWIS/KiWIS'
+    with SEPAClient(url, str(tmp_path)) as client:
+        with pytest.raises(SEPAError):
+            client.getTimeseriesId('Dippen')
+    listener.close()
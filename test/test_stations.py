@@ -0,0 +1,48 @@
+import pytest
+import pandas as pd
+import DataGeneratorScenarios
+from DataGeneratorSEPA import SEPAError, LocalKiWISServer, fetchRainfall
+from DataGeneratorScenarios import runStations
+
+STATIONS = {'Dippen': 1000, 'Brodick': 2000, 'Lamlash': 3000}
+SAMPLES = 96 * 2
+DELAY = 0.2
+
+def test_concurrency_limits_the_downloads_in_flight(tmp_path):
+    # The delay keeps each request in progress long enough for the others to start alongside it.
+    stations = {name: 1000 * i for i, name in enumerate(['A', 'B', 'C', 'D', 'E', 'F'], start=1)}
+    for concurrency in [1, 2, 6]:
+        with LocalKiWISServer(stations, delay=DELAY) as server:
+            results = list(fetchRainfall(stations, SAMPLES, concurrency=concurrency, baseUrl=server.url, cacheDirectory=str(tmp_path / str(concurrency))))
+        assert sorted(name for name, rainfall, error in results) == sorted(stations)
+        assert all(error is None and len(rainfall) == SAMPLES for name, rainfall, error in results)
+        assert server.peakActiveRequests <= concurrency
+        if concurrency > 1:
+            assert server.peakActiveRequests > 1
+
+def test_failed_stations_are_reported_and_the_rest_generated(predictors, tmp_path):
+    with LocalKiWISServer(STATIONS) as server:
+        results, errors = runStations(dict(STATIONS, Missing=58.5), predictors, SAMPLES, workers=1, baseUrl=server.url, cacheDirectory=str(tmp_path))
+    assert list(errors) == ['Missing']
+    assert isinstance(errors['Missing'], SEPAError)
+    assert list(results.index.unique('Scenario')) == list(STATIONS)
+    assert len(results) == len(STATIONS) * SAMPLES
+
+def test_results_dont_depend_on_download_order_or_workers(predictors, tmp_path, monkeypatch):
+    stations = {name: 30 + 10 * i for i, name in enumerate(STATIONS)}
+    with LocalKiWISServer(STATIONS) as server:
+        # One at a time, the stations finish in the order given.
+        inOrder, errors = runStations(stations, predictors, SAMPLES, workers=1, concurrency=1, baseUrl=server.url, cacheDirectory=str(tmp_path / 'first'))
+        assert errors == {}
+
+        # Hand the downloads over in the reverse order.
+        def reversedDownloads(*args, **kwargs):
+            downloads = list(fetchRainfall(*args, **kwargs))
+            assert [name for name, rainfall, error in downloads] == list(stations)
+            return reversed(downloads)
+        monkeypatch.setattr(DataGeneratorScenarios, 'fetchRainfall', reversedDownloads)
+        for workers in [1, 2]:
+            outOfOrder, errors = runStations(stations, predictors, SAMPLES, workers=workers, concurrency=1, baseUrl=server.url,
+                                             cacheDirectory=str(tmp_path / str(workers)))
+            assert errors == {}
+            pd.testing.assert_frame_equal(inOrder, outOfOrder)
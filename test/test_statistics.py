@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from DataGenerator import DataGenerator
+from DataGeneratorStatistics import QuantileSketch
+
+GENERATED_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data', 'Generated Data')
+
+def test_sketch_is_exact_below_max_size():
+    values = np.round(np.random.default_rng(0).gamma(2, 1, 50000), 3)
+    sketches = []
+    for chunk in np.array_split(values, 7):
+        sketch = QuantileSketch()
+        sketch.add(chunk)
+        sketches.append(sketch)
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+
+    for q in [0, 0.1, 0.25, 0.5, 0.75, 0.9, 1]:
+        assert merged.quantile(q) == pd.Series(values).quantile(q)
+
+@pytest.mark.parametrize('maxSize', [100, 1000])
+def test_compressed_sketch_stays_within_its_rank_error(maxSize):
+    # Once there are more than maxSize distinct values the sketch is compressed. The rank of each estimated quantile should then be
+    # within 2 / maxSize of q, even after many chunks have been added and sketches merged.
+    values = np.random.default_rng(1).normal(size=200000)
+    merged = QuantileSketch(maxSize)
+    for chunk in np.array_split(values, 40):
+        sketch = QuantileSketch(maxSize)
+        for part in np.array_split(chunk, 5):
+            sketch.add(part)
+        merged.merge(sketch)
+
+    assert len(merged.values) <= maxSize
+    assert merged.count() == len(values)
+    ordered = np.sort(values)
+    for q in np.linspace(0.01, 0.99, 99):
+        rank = np.searchsorted(ordered, merged.quantile(q)) / len(values)
+        assert abs(rank - q) <= 2 / maxSize
+
+@pytest.mark.parametrize('chunkSize', [None, 7, 37, 100000])
+def test_simplified_data_matches_the_baseline(predictors, tmp_path, chunkSize):
+    # "Simplified Daily Data.csv" was made by the original in-memory simplifyData. One of its lines has a trailing space, so the lines
+    # are compared without trailing whitespace.
+    dg = DataGenerator(predictors=predictors)
+    output = str(tmp_path / 'Simplified Daily Data.csv')
+    dg.simplifyData(os.path.join(GENERATED_DATA, 'Daily Generated Data.csv'), output, chunkSize=chunkSize)
+    with open(output, 'r') as f:
+        lines = [line.rstrip() for line in f]
+    with open(os.path.join(GENERATED_DATA, 'Simplified Generated Data', 'Simplified Daily Data.csv'), 'r') as f:
+        baseline = [line.rstrip() for line in f]
+    assert lines == baseline